@@ -0,0 +1,137 @@
+import pandas as pd
+import os, json, time, functools
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import mine_utils
+from mine_utils import ProcAnn, get_log, get_source_key
+from mine_cache import log_fingerprint
+
+# batch rendering of (log, miner, annotation, output path) jobs in a worker pool
+# - log: dataframe or path to csv
+# - miner: 'dfg', 'heur', 'alpha', 'ilp', 'induct' or 'bpmn' / 'petri_net' (inductive miner, converted)
+# - ann: ProcAnn (or None)
+# - output path: without extension; .jpg & .gv are written (like mine_* with save_gviz)
+# (outputs that are up to date with their job are skipped)
+# (lods: coverages (%) for level-of-detail svgs of the dfg jobs; see mine_dfg_lods & graphs.json)
+
+formats_with_ann = [ 'dfg', 'heur' ]
+
+def render_batch(jobs, workers=None, force=False, manifest_dir=None, default_format="bpmn", default_ann=ProcAnn.FREQ, lods=None):
+    jobs = [ tuple(job) for job in jobs ]
+    stamps = [ job_stamp(job, lods) for job in jobs ]
+
+    up_to_date = [ not force and is_up_to_date(job[3], stamp, job_lods(job, lods)) for job, stamp in zip(jobs, stamps) ]
+    todo = [ (job, stamp) for job, stamp, done in zip(jobs, stamps, up_to_date) if not done ]
+    results = [ { 'output_path': job[3], 'miner': job[1], 'status': 'skipped', 'time': 0.0, 'error': None }
+               for job, done in zip(jobs, up_to_date) if done ]
+
+    render = functools.partial(render_job, lods=lods)
+    if workers is None:
+        results += [ render(job, stamp) for job, stamp in todo ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results += list(pool.map(render, *zip(*todo))) if len(todo) > 0 else []
+
+    if manifest_dir is not None:
+        names = list(dict.fromkeys(os.path.basename(job[3]) for job in jobs))
+        write_manifest(names, default_format, default_ann, manifest_dir, lods)
+
+    return pd.DataFrame(results, columns=[ 'output_path', 'miner', 'status', 'time', 'error' ])
+
+
+def render_job(job, stamp, lods=None):
+    log, miner, ann, output_path = job
+    start = time.perf_counter()
+    try:
+        if isinstance(log, (str, Path)):
+            log = get_log(str(log), columns=[ 'case:concept:name', 'concept:name', 'time:timestamp' ])
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+        match miner:
+            case 'dfg':
+                mine_utils.mine_dfg(log, ann or ProcAnn.FREQ, output_path=output_path, save_gviz=True)
+                if lods is not None:
+                    mine_utils.mine_dfg_lods(log, ann or ProcAnn.FREQ, output_path=output_path, coverages=lods)
+            case 'heur':
+                mine_utils.mine_heur(log, ann or ProcAnn.FREQ, output_path=output_path, save_gviz=True)
+            case 'alpha':
+                mine_utils.mine_alpha(log, output_path=output_path, save_gviz=True)
+            case 'ilp':
+                mine_utils.mine_ilp(log, output_path=output_path, save_gviz=True)
+            case 'induct':
+                mine_utils.mine_induct(log, output_path=output_path, save_gviz=True)
+            case 'bpmn' | 'petri_net':
+                mine_utils.mine_induct(log, convert_to=miner, ann=ann, output_path=output_path, save_gviz=True)
+            case _:
+                raise ValueError(f"Unsupported miner: {miner}")
+
+        # only stamp when all went well
+        with open(f"{output_path}.stamp", "w") as f:
+            f.write(stamp)
+        return { 'output_path': output_path, 'miner': miner, 'status': 'rendered', 'time': time.perf_counter() - start, 'error': None }
+
+    except Exception as e:
+        return { 'output_path': output_path, 'miner': miner, 'status': 'failed', 'time': time.perf_counter() - start, 'error': repr(e) }
+
+
+# identifies the job's inputs
+# (for csv paths, file size & mtime avoid loading the log)
+def job_stamp(job, lods=None):
+    log, miner, ann, _ = job
+    if isinstance(log, (str, Path)):
+        source = { 'path': os.path.abspath(log), **get_source_key(str(log)) }
+    else:
+        source = { 'fingerprint': log_fingerprint(log) }
+    stamp = { 'source': source, 'miner': miner, 'ann': ann.value if ann is not None else None }
+    if job_lods(job, lods) is not None:
+        stamp['lods'] = list(lods)
+    return json.dumps(stamp, sort_keys=True)
+
+
+def job_lods(job, lods):
+    return lods if job[1] == 'dfg' else None
+
+
+def is_up_to_date(output_path, stamp, lods=None):
+    outputs = [ f"{output_path}.jpg", f"{output_path}.gv", f"{output_path}.stamp" ]
+    outputs += [ f"{output_path}.lod{coverage}.svg" for coverage in (lods or []) ]
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    with open(f"{output_path}.stamp") as f:
+        return f.read() == stamp
+
+
+# jobs for all sublogs (csv) in log_dir, in the layout the viewer expects
+# (<out_dir>/<format>[/<ann>]/<name>)
+def level_jobs(log_dir, out_dir, formats=[ 'dfg', 'heur', 'bpmn', 'petri_net' ], anns=[ ProcAnn.FREQ, ProcAnn.PERF ]):
+    jobs = []
+    for path in sorted(Path(log_dir).rglob("*.csv")):
+        name = path.stem
+        for format in formats:
+            if format in formats_with_ann:
+                jobs += [ (str(path), format, ann, os.path.join(out_dir, format, ann.value, name)) for ann in anns ]
+            else:
+                jobs.append((str(path), format, None, os.path.join(out_dir, format, name)))
+    return jobs
+
+
+# graphs.json, as fetched by viewer/index.html
+# (lods: coverages of the dfgs' level-of-detail svgs, if any)
+def write_manifest(names, default_format, default_ann, path, lods=None):
+    manifest = get_manifest(names, default_format, default_ann, lods)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "graphs.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def get_manifest(names, default_format, default_ann, lods=None):
+    def entry_pref():
+        if default_format in formats_with_ann:
+            return { 'format': default_format, 'ann': default_ann.value }
+        else:
+            return { 'format': default_format }
+
+    manifest = { 'all': names, 'prefs': { name: entry_pref() for name in names } }
+    if lods is not None:
+        manifest['lods'] = list(lods)
+    return manifest
@@ -0,0 +1,453 @@
+import pandas as pd
+import numpy as np
+import os, sys, json, time, platform, tempfile, tracemalloc, argparse, shutil
+from contextlib import redirect_stdout
+import mine_utils
+import log_stats
+from mine_utils import ProcAnn, get_log, aggregate_events, equal_timestamps_interval, get_time_diff
+from variant_stats import get_variants_stats, get_covering_variants, filter_traces_on_variants
+from cluster_utils import sequences_to_transit_matrix
+from separ_subproc import separ_subproc
+from trace_index import TraceIndex
+
+# benchmark suite: time & peak memory (tracemalloc) of the main utilities on synthetic logs
+# (logs are generated from a seed, so runs are comparable across machines & commits)
+#
+# python benchmark.py --sizes 1e4 1e5 1e6 1e7 --out baseline.json
+# python benchmark.py --sizes 1e4 1e5 --compare baseline.json (exits with 1 on regressions)
+# python benchmark.py --only get_variants_stats separ_subproc --plot scaling.png
+# python benchmark.py --sizes 1e4 --check (fast paths vs. their reference implementations; exits with 1 on differences)
+
+
+# - synthetic logs, shaped like the IRCC log
+# (case:concept:name, concept:name, time:timestamp, activity, activity_status, act_upd_by, group)
+# - num_events: (approximate) total # events
+# - events_per_case: mean trace length
+# - num_activs: # activities; the first third are subprocesses with several statuses
+# - variant_skew: Zipf exponent of the variant frequencies (0: uniform; higher: few dominant variants)
+# - num_templates: # distinct base variants (default: one per 10 cases)
+# - simult_rate: share of events less than a minute after their predecessor
+
+statuses = [ 'Open', 'In Progress', 'On Hold', 'Completed' ]
+
+def generate_log(num_events, events_per_case=20, num_activs=60, variant_skew=1.1, num_templates=None,
+                 simult_rate=0.2, num_users=200, seed=0):
+    rng = np.random.default_rng(seed)
+    num_cases = max(1, int(num_events) // events_per_case)
+    num_templates = max(1, num_cases // 10) if num_templates is None else num_templates
+
+    # base variants; activities (& statuses) with a skewed popularity
+    activ_probs = 1 / np.arange(1, num_activs + 1)
+    activ_probs /= activ_probs.sum()
+    tmpl_lengths = np.maximum(1, rng.poisson(events_per_case, num_templates))
+    tmpl_offsets = np.r_[0, np.cumsum(tmpl_lengths)]
+    tmpl_activs = rng.choice(num_activs, tmpl_offsets[-1], p=activ_probs)
+    is_subproc = tmpl_activs < num_activs // 3
+    tmpl_statuses = np.where(is_subproc, rng.integers(0, len(statuses), tmpl_offsets[-1]), len(statuses) - 1)
+
+    # cases pick a base variant (Zipf weights)
+    tmpl_probs = 1 / np.arange(1, num_templates + 1) ** variant_skew
+    tmpl_probs /= tmpl_probs.sum()
+    case_tmpls = rng.choice(num_templates, num_cases, p=tmpl_probs)
+    lengths = tmpl_lengths[case_tmpls]
+    starts = tmpl_offsets[case_tmpls]
+    case_codes = np.repeat(np.arange(num_cases), lengths)
+    src = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+    activs, stats = tmpl_activs[src], tmpl_statuses[src]
+
+    # timestamps: case starts within a year; gaps of hours to days, or < 1 min ("simultaneous")
+    gaps = np.where(rng.random(len(src)) < simult_rate, rng.integers(0, 60, len(src)), rng.exponential(86_400, len(src)).astype(np.int64))
+    case_firsts = np.r_[True, case_codes[1:] != case_codes[:-1]]
+    gaps[case_firsts] = rng.integers(0, 365 * 86_400, num_cases)
+    # (cumulative within each case)
+    secs = np.cumsum(gaps)
+    secs -= np.repeat(secs[case_firsts] - gaps[case_firsts], lengths)
+
+    activ_names = np.array([ f"Activity {i}" for i in range(num_activs) ], dtype=object)
+    status_names = np.array(statuses, dtype=object)
+    log = pd.DataFrame({
+        'case:concept:name': pd.Series(np.array([ f"case-{i}" for i in range(num_cases) ], dtype=object)[case_codes]),
+        'activity': activ_names[activs],
+        'activity_status': status_names[stats],
+        'time:timestamp': pd.Timestamp("2023-01-01") + pd.to_timedelta(secs, unit='s'),
+        'act_upd_by': rng.integers(0, num_users, len(src)),
+        'group': rng.integers(0, 10, len(src)),
+    })
+    log.insert(1, 'concept:name', log['activity'] + " - " + log['activity_status'])
+    return log
+
+
+# - benchmarks
+# (setup runs untimed; returns the function to time)
+
+def bench_get_log(log, tmp_dir):
+    path = os.path.join(tmp_dir, "log.csv")
+    log.to_csv(path, index=False)
+    return lambda: get_log(path, cache=False)
+
+def bench_get_log_cached(log, tmp_dir):
+    path = os.path.join(tmp_dir, "log_cached.csv")
+    log.to_csv(path, index=False)
+    get_log(path) # (writes the cache)
+    return lambda: get_log(path)
+
+def bench_aggregate_events(engine):
+    def bench(log, tmp_dir):
+        log = log.sort_values(by=[ 'case:concept:name', 'time:timestamp' ]).reset_index(drop=True)
+        events = [ f"Activity 0 - {status}" for status in statuses[:2] ]
+        return lambda: aggregate_events(log, events, 60, engine=engine)
+    return bench
+
+# (time_diff precomputed; get_time_diff is a separate step)
+def bench_equal_timestamps_interval(measure):
+    def bench(log, tmp_dir):
+        log = get_time_diff(log)
+        if measure == 'explode':
+            return lambda: equal_timestamps_interval_explode(log, 60)
+        return lambda: equal_timestamps_interval(log, 60, measure)
+    return bench
+
+def bench_get_variants_stats(log, tmp_dir):
+    return lambda: get_variants_stats(log, plot=False)
+
+def bench_filter_traces_on_variants(log, tmp_dir):
+    variants = get_covering_variants(80, get_variants_stats(log, plot=False))
+    return lambda: filter_traces_on_variants(log, variants)
+
+def bench_filter_traces_on_variants_merge(log, tmp_dir):
+    variants = get_covering_variants(80, get_variants_stats(log, plot=False))
+    return lambda: filter_traces_on_variants_merge(log, variants)
+
+def bench_trace_index(log, tmp_dir):
+    return lambda: TraceIndex.from_log(log)
+
+def bench_transit_matrix(log, tmp_dir):
+    sequences = TraceIndex.from_log(log).variant_sequences()
+    return lambda: sequences_to_transit_matrix(sequences, as_sparse=True)
+
+def bench_separ_subproc(log, tmp_dir):
+    counts = log[[ 'activity', 'activity_status' ]].drop_duplicates().groupby('activity')['activity_status'].count()
+    is_subproc = log['activity'].isin(counts[counts >= 2].index)
+    subproc_evts, non_subproc_evts = log[is_subproc], log[~is_subproc]
+    dir_subproc = os.path.join(tmp_dir, "subproc")
+    path_log = os.path.join(tmp_dir, "abstracted.csv")
+    def run():
+        # (fresh dir; otherwise unchanged sublogs are skipped)
+        shutil.rmtree(dir_subproc, ignore_errors=True)
+        separ_subproc(subproc_evts, non_subproc_evts, 'activity', 'activity_status', 'concept:name', dir_subproc, path_log)
+    return run
+
+def bench_miner(miner):
+    def bench(log, tmp_dir):
+        output_path = os.path.join(tmp_dir, f"mine_{miner}")
+        match miner:
+            case 'dfg':
+                return lambda: mine_utils.mine_dfg(log, ProcAnn.FREQ, output_path=output_path)
+            case 'dfg_perf':
+                return lambda: mine_utils.mine_dfg(log, ProcAnn.PERF, output_path=output_path)
+            case 'heur':
+                return lambda: mine_utils.mine_heur(log, ProcAnn.FREQ, output_path=output_path)
+            case 'induct':
+                return lambda: mine_utils.mine_induct(log, output_path=output_path)
+    return bench
+
+benchmarks = {
+    'get_log': bench_get_log,
+    'get_log_cached': bench_get_log_cached,
+    'aggregate_events': bench_aggregate_events('numpy'),
+    'aggregate_events_loop': bench_aggregate_events('loop'),
+    'equal_timestamps_interval': bench_equal_timestamps_interval('chained'),
+    'equal_timestamps_interval_anchor': bench_equal_timestamps_interval('anchor'),
+    'equal_timestamps_interval_explode': bench_equal_timestamps_interval('explode'),
+    'get_variants_stats': bench_get_variants_stats,
+    'filter_traces_on_variants': bench_filter_traces_on_variants,
+    'filter_traces_on_variants_merge': bench_filter_traces_on_variants_merge,
+    'trace_index': bench_trace_index,
+    'transit_matrix': bench_transit_matrix,
+    'separ_subproc': bench_separ_subproc,
+    'mine_dfg': bench_miner('dfg'),
+    'mine_dfg_perf': bench_miner('dfg_perf'),
+    'mine_heur': bench_miner('heur'),
+    'mine_induct': bench_miner('induct'),
+}
+
+# (miners get slow on large logs; only run these up to max_mine_events)
+mine_benchmarks = [ name for name in benchmarks if name.startswith('mine_') ]
+# (same for the (slow) reference implementations; up to max_reference_events)
+reference_benchmarks = [ 'aggregate_events_loop', 'filter_traces_on_variants_merge', 'equal_timestamps_interval_explode' ]
+
+
+# - reference implementations
+# (former versions of the utilities, to compare against)
+
+# tuple per case, merged onto every event
+def filter_traces_on_variants_merge(log, variants):
+    traces = log.groupby('case:concept:name')['concept:name'].apply(tuple).rename('sequence').reset_index()
+    merged_log = log.merge(traces)
+    filtered_log = merged_log[merged_log['sequence'].isin(variants['sequence'])]
+    return filtered_log[[ 'case:concept:name', 'concept:name', 'time:timestamp' ]]
+
+# range list per bucket, exploded & merged back onto the events
+# (adds time_diff2 to the given log)
+def equal_timestamps_interval_explode(log, interval):
+    # (first events of cases: NaN in get_time_diff; formerly 1_000_000)
+    log['time_diff2'] = log['time_diff'].fillna(1_000_000)
+    log.loc[log['time_diff2'] < interval, 'time_diff2'] = 0
+
+    intervals = log[log['time_diff2'] > 0][['index', 'time:timestamp']]
+    intervals['from'] = intervals['index']
+    intervals['to'] = intervals['index'].shift(-1)
+    intervals.iloc[-1, 3] = log['index'].max() + 1
+
+    def gen_interval(row):
+        if row.iloc[0] == row.iloc[1]:
+            return [int(row.iloc[0])]
+        else:
+            return range(int(row.iloc[0]), int(row.iloc[1]))
+
+    intervals['list'] = intervals[['from', 'to']].apply(gen_interval, axis=1)
+    intervals = intervals.set_index(intervals['time:timestamp'])
+    intervals = intervals[['list']]
+    intervals = intervals['list'].explode().reset_index()
+    intervals = intervals.rename({'time:timestamp': 'time:timestamp2', 'list': 'index'}, axis=1)
+
+    log2 = log.merge(intervals, left_on='index', right_on='index', how='left')
+    log2.loc[log2['time_diff2']>0, 'time:timestamp2'] = log2.loc[log2['time_diff2']>0, 'time:timestamp']
+    log2 = log2.drop([ 'time_diff', 'time_diff2', 'time:timestamp' ], axis=1)
+    log2 = log2.rename({ 'time:timestamp2': 'time:timestamp' }, axis=1)
+    return log2.sort_values(by=['case:concept:name', 'time:timestamp', 'concept:name'])
+
+
+# - checks
+# (fast paths vs. their reference implementations, on the same synthetic logs)
+# (setup like the benchmarks; the returned function raises AssertionError on differences)
+
+def check_aggregate_events(log, tmp_dir):
+    log = log.sort_values(by=[ 'case:concept:name', 'time:timestamp' ]).reset_index(drop=True)
+    event_sets = [ [ f"Activity 0 - {status}" for status in statuses[:2] ],
+                   [ f"Activity 1 - {status}" for status in statuses[:3] ] ]
+    def run():
+        for events in event_sets:
+            for max_timedelta, repl in [ (60, None), (3600, None), (60, "aggregated") ]:
+                expected = aggregate_events(log, events, max_timedelta, repl, engine='loop')
+                actual = aggregate_events(log, events, max_timedelta, repl, engine='numpy')
+                pd.testing.assert_frame_equal(actual, expected)
+    return run
+
+# (the reference takes the log's row order for ties; so, sorted like TraceIndex)
+def check_filter_traces_on_variants(log, tmp_dir):
+    log = log.sort_values(by=[ 'case:concept:name', 'time:timestamp', 'concept:name' ]).reset_index(drop=True)
+    variants = get_covering_variants(80, get_variants_stats(log, plot=False))
+    columns = [ 'case:concept:name', 'concept:name', 'time:timestamp' ]
+    def run():
+        expected = filter_traces_on_variants_merge(log, variants).reset_index(drop=True)
+        actual = filter_traces_on_variants(log, variants)[columns].reset_index(drop=True)
+        pd.testing.assert_frame_equal(actual, expected)
+    return run
+
+def check_equal_timestamps_interval(log, tmp_dir):
+    log = get_time_diff(log)
+    columns = [ 'index', 'case:concept:name', 'concept:name', 'time:timestamp' ]
+    def run():
+        for interval in [ 30, 60, 3600 ]:
+            expected = equal_timestamps_interval_explode(log.copy(), interval).sort_values(by='index')[columns].reset_index(drop=True)
+            actual = equal_timestamps_interval(log, interval).sort_values(by='index')[columns].reset_index(drop=True)
+            pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    return run
+
+# profiled logs (& frames derived from them) can still be written to parquet
+# (i.e., nothing non-serializable is left on log.attrs)
+def check_profile_parquet(log, tmp_dir):
+    def run():
+        log_stats.clear_profiles()
+        mine_utils.count_events(log, plot=False)
+        assert log_stats.get_profile(log) is log_stats.get_profile(log.copy()), "profile not shared"
+        log.to_parquet(os.path.join(tmp_dir, "profiled.parquet"), index=False)
+        log[log['group'] > 4].to_parquet(os.path.join(tmp_dir, "derived.parquet"), index=False)
+    return run
+
+# a copy with one changed row (same shape & dtypes) must get a fresh profile, not the stale one of the original
+def check_profile_fresh_copy(log, tmp_dir):
+    def run():
+        log_stats.clear_profiles()
+        profile = log_stats.get_profile(log)
+        changed = log.copy()
+        changed.loc[changed.index[1], 'case:concept:name'] = "changed case"
+        fresh = log_stats.get_profile(changed)
+        assert fresh is not profile, "stale profile shared with a changed copy"
+        assert "changed case" in fresh.case_ids, "changed case missing from profile"
+    return run
+
+checks = {
+    'aggregate_events': check_aggregate_events,
+    'filter_traces_on_variants': check_filter_traces_on_variants,
+    'equal_timestamps_interval': check_equal_timestamps_interval,
+    'profile_parquet': check_profile_parquet,
+    'profile_fresh_copy': check_profile_fresh_copy,
+}
+
+
+# time (best of repeat) & peak memory (separate run, under tracemalloc) of each benchmark, per log size
+def run_benchmarks(sizes, names=None, repeat=1, memory=True, max_mine_events=1_000_000, max_reference_events=100_000,
+                   seed=0, verbose=True, **gen_args):
+    names = list(benchmarks) if names is None else names
+    results = []
+    for size in sizes:
+        size = int(size)
+        log = generate_log(size, seed=seed, **gen_args)
+        for name in names:
+            if name in mine_benchmarks and size > max_mine_events:
+                continue
+            if name in reference_benchmarks and size > max_reference_events:
+                continue
+            result = { 'benchmark': name, 'events': len(log), 'size': size, 'time': None, 'peak_mb': None, 'error': None }
+            # (the utilities' own prints would drown the results)
+            with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                try:
+                    fn = benchmarks[name](log, tmp_dir)
+                    times = []
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        fn()
+                        times.append(time.perf_counter() - start)
+                    result['time'] = min(times)
+                    if memory:
+                        tracemalloc.start()
+                        try:
+                            fn()
+                            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+                        finally:
+                            tracemalloc.stop()
+                except Exception as e:
+                    result['error'] = repr(e)
+            if verbose:
+                print(format_result(result), flush=True)
+            results.append(result)
+    return results
+
+
+# each check, per log size
+# (checks against slow reference implementations; all of them up to max_reference_events)
+def run_checks(sizes, names=None, max_reference_events=100_000, seed=0, verbose=True, **gen_args):
+    names = list(checks) if names is None else names
+    results = []
+    for size in sizes:
+        size = int(size)
+        if size > max_reference_events:
+            continue
+        log = generate_log(size, seed=seed, **gen_args)
+        for name in names:
+            result = { 'check': name, 'events': len(log), 'size': size, 'error': None }
+            with tempfile.TemporaryDirectory() as tmp_dir, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                try:
+                    checks[name](log, tmp_dir)()
+                except Exception as e:
+                    result['error'] = repr(e)
+            if verbose:
+                status = "ok" if result['error'] is None else f"failed: {result['error']}"
+                print(f"{name:<32} {size:>10}  {status}", flush=True)
+            results.append(result)
+    return results
+
+
+def format_result(result):
+    if result['error'] is not None:
+        return f"{result['benchmark']:<32} {result['size']:>10}  failed: {result['error']}"
+    peak = f"{result['peak_mb']:10.1f} MiB" if result['peak_mb'] is not None else ""
+    return f"{result['benchmark']:<32} {result['size']:>10}  {result['time']:10.3f} s {peak}"
+
+
+# - baselines
+
+def save_baseline(results, path, params):
+    baseline = { 'meta': { 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                           'platform': platform.platform(), 'created': time.strftime("%Y-%m-%dT%H:%M:%S"), 'params': params },
+                 'results': results }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=1)
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+# per benchmark & size (in both): time & memory ratios (current / baseline)
+# (regression: time ratio above max_ratio)
+def compare_baseline(results, baseline, max_ratio=1.25):
+    base = { (r['benchmark'], r['size']): r for r in baseline['results'] if r['error'] is None }
+    rows = []
+    for r in results:
+        b = base.get((r['benchmark'], r['size']))
+        if b is None or r['error'] is not None:
+            continue
+        time_ratio = r['time'] / b['time'] if b['time'] > 0 else np.nan
+        mem_ratio = r['peak_mb'] / b['peak_mb'] if r['peak_mb'] is not None and b['peak_mb'] else np.nan
+        rows.append({ 'benchmark': r['benchmark'], 'size': r['size'], 'time': r['time'], 'base_time': b['time'],
+                      'time_ratio': time_ratio, 'mem_ratio': mem_ratio, 'regression': time_ratio > max_ratio })
+    return pd.DataFrame(rows, columns=[ 'benchmark', 'size', 'time', 'base_time', 'time_ratio', 'mem_ratio', 'regression' ])
+
+
+# log-log scaling curves (time & peak memory vs. # events)
+def plot_scaling(results, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    df = pd.DataFrame([ r for r in results if r['error'] is None ])
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for name, group in df.groupby('benchmark'):
+        axes[0].plot(group['events'], group['time'], marker='o', label=name)
+        if group['peak_mb'].notna().any():
+            axes[1].plot(group['events'], group['peak_mb'], marker='o', label=name)
+    for ax, label in zip(axes, [ 'time (s)', 'peak memory (MiB)' ]):
+        ax.set_xscale('log'); ax.set_yscale('log')
+        ax.set_xlabel('# events'); ax.set_ylabel(label)
+    axes[0].legend(fontsize='small')
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="time & peak memory of the log utilities on synthetic logs")
+    parser.add_argument('--sizes', nargs='+', type=float, default=[ 1e4, 1e5, 1e6, 1e7 ], help="# events per log")
+    parser.add_argument('--only', nargs='+', choices=sorted(set(benchmarks) | set(checks)), help="run only these benchmarks (or checks)")
+    parser.add_argument('--repeat', type=int, default=1, help="timed runs per benchmark (best is kept)")
+    parser.add_argument('--no-memory', action='store_true', help="skip the (slower) peak memory runs")
+    parser.add_argument('--max-mine-events', type=float, default=1e6, help="largest log for the mine_* benchmarks")
+    parser.add_argument('--max-reference-events', type=float, default=1e5, help="largest log for the reference implementations (& checks)")
+    parser.add_argument('--check', action='store_true', help="run the checks instead of the benchmarks")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--events-per-case', type=int, default=20)
+    parser.add_argument('--activities', type=int, default=60)
+    parser.add_argument('--variant-skew', type=float, default=1.1)
+    parser.add_argument('--simult-rate', type=float, default=0.2)
+    parser.add_argument('--out', help="store results as a baseline (json)")
+    parser.add_argument('--compare', help="compare with a baseline (json)")
+    parser.add_argument('--max-ratio', type=float, default=1.25, help="time ratio above which a result is a regression")
+    parser.add_argument('--plot', help="save scaling curves (png)")
+    args = parser.parse_args(argv)
+
+    gen_args = { 'events_per_case': args.events_per_case, 'num_activs': args.activities,
+                 'variant_skew': args.variant_skew, 'simult_rate': args.simult_rate }
+    if args.check:
+        names = None if args.only is None else [ name for name in args.only if name in checks ]
+        results = run_checks(args.sizes, names, int(args.max_reference_events), args.seed, **gen_args)
+        return 1 if any(result['error'] is not None for result in results) else 0
+
+    names = None if args.only is None else [ name for name in args.only if name in benchmarks ]
+    results = run_benchmarks(args.sizes, names, args.repeat, not args.no_memory, int(args.max_mine_events),
+                             int(args.max_reference_events), args.seed, **gen_args)
+
+    if args.out is not None:
+        save_baseline(results, args.out, { 'seed': args.seed, 'repeat': args.repeat, **gen_args })
+    if args.plot is not None:
+        plot_scaling(results, args.plot)
+    if args.compare is not None:
+        comparison = compare_baseline(results, load_baseline(args.compare), args.max_ratio)
+        print(comparison.to_string(index=False))
+        if comparison['regression'].any():
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,9 +3,26 @@ from collections_extended import frozenbag
 #from itertools import chain
 import numpy
 import scipy
+import scipy.sparse
 import sklearn.preprocessing
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pm4py.algo.evaluation import algorithm as general_evaluation
+from pm4py.algo.conformance.tokenreplay.variants import token_replay
+from pm4py.algo.evaluation.precision import utils as precision_utils
+from pm4py.algo.evaluation.simplicity.variants import arc_degree as simplicity_arc_degree
+from pm4py.objects.petri_net.utils.align_utils import get_visible_transitions_eventually_enabled_by_marking
+from pm4py.objects.log.obj import EventLog, Trace, Event
+from pm4py.util import constants as pm4py_constants
+from collections import Counter
+import math
+from trace_index import TraceIndex, get_trace_index
+from variant_stats import get_variants
+from instrument import instrument, report, span
+from sklearn.cluster import MiniBatchKMeans
 
+@instrument
 def sequences_to_sets(sequences):
     sets = {}
     for seq in sequences:
@@ -25,6 +42,7 @@ def sequences_to_sets(sequences):
     return df
 
 
+@instrument
 def sequences_to_bags(sequences):
     bags = {}
     for seq in sequences:
@@ -44,17 +62,16 @@ def sequences_to_bags(sequences):
     return df
 
 
+# (log can also be a TraceIndex; skips sorting & regrouping the log)
+@instrument
 def log_per_case(log, callback):
     # inspired by pm4py's get_variants
-    log = log.sort_values(by=[ 'case:concept:name', 'time:timestamp', 'concept:name' ])
-    log = log.reset_index(drop=True)
-    unique_cases, case_indexes, num_evts_per_case = numpy.unique(log['case:concept:name'], return_index=True, return_counts=True)
+    index = get_trace_index(log)
 
-    for case_id, case_idx, num_evts in zip(unique_cases, case_indexes, num_evts_per_case):
-        # case_evts = log.loc[case_idx:(case_idx+num_evts-1),:] (debugging)
-        case_evts = list(log['concept:name'][case_idx:(case_idx+num_evts)])
-        callback(case_id, case_evts)
+    for case, case_id in enumerate(index.case_ids):
+        callback(case_id, index.case_sequence(case))
 
+@instrument
 def log_to_sequences_list(log):
     sequences = []
     log_per_case(log, lambda _, case_evts: list.append(case_evts))
@@ -62,6 +79,7 @@ def log_to_sequences_list(log):
     return sequences
         
 
+@instrument
 def log_to_sequences_df(log, columns=[ 'case:concept_name', 'sequence' ]):
     cases = []
     log_per_case(log, lambda case_id, case_evts: cases.append([ case_id, case_evts ]))
@@ -69,35 +87,85 @@ def log_to_sequences_df(log, columns=[ 'case:concept_name', 'sequence' ]):
     return pd.DataFrame(cases, columns=columns)
     
 
+@instrument
 def sequences_to_transit_matrix(sequences, as_sparse=False, normalize_axis=None):
-    # collect unique activities
-    unique_activ = {evt for seq in sequences for evt in seq}
-    
-    # create transit matrix where row is src activ, col is tgt activ, 
+    # integer-code all sequences
+    # (concatenated, with per-sequence offsets)
+    sequences = [ list(seq) for seq in sequences ]
+    lengths = numpy.array([ len(seq) for seq in sequences ], dtype=numpy.int64)
+    codes, activs = pd.factorize(pd.Series([ evt for seq in sequences for evt in seq ]), sort=True)
+    offsets = numpy.r_[0, numpy.cumsum(lengths)]
+
+    # row is src activ, col is tgt activ,
     # value is number of directed edges in all sequences
-    # (initially all 0's)
-    transit_matrix = pd.DataFrame(0, index=unique_activ, columns=unique_activ)
-    for seq in sequences:
-        # per pair of events in sequence, create tuple between src & tgt
-        transit_tuples = [ (seq[i], seq[i+1]) for i in range(0, len(seq) - 1) ]
-        # for each transit tuple, update count in transit matrix
-        for src, tgt in transit_tuples:
-            transit_matrix[tgt][src] += 1
-
-    if as_sparse:
-        transit_matrix = scipy.sparse.csr_matrix(transit_matrix.values)
+    transit_matrix, _, _ = codes_to_transit_matrix(codes, offsets, activs)
+
+    if not as_sparse:
+        transit_matrix = pd.DataFrame(transit_matrix.toarray(), index=activs, columns=activs)
     if normalize_axis is not None:
         transit_matrix = sklearn.preprocessing.normalize(transit_matrix, norm="l1", axis=normalize_axis)
 
     return transit_matrix
 
 
+# directly from the event log; returns sparse matrix, src labels, tgt labels
+# (with order k, rows are the k preceding activities (tuples))
+@instrument
+def log_to_transit_matrix(log, order=1, normalize_axis=None):
+    log = log.sort_values(by=[ 'case:concept:name', 'time:timestamp', 'concept:name' ], kind='stable')
+    codes, activs = pd.factorize(log['concept:name'], sort=True)
+    cases = log['case:concept:name'].to_numpy()
+    offsets = numpy.r_[0, numpy.flatnonzero(cases[1:] != cases[:-1]) + 1, len(cases)]
+
+    return codes_to_transit_matrix(codes, offsets, activs, order, normalize_axis)
+
+
+# codes: integer-coded activities of all cases (concatenated)
+# offsets: start of each case in codes (+ total length at the end)
+@instrument
+def codes_to_transit_matrix(codes, offsets, activs, order=1, normalize_axis=None):
+    codes = numpy.asarray(codes, dtype=numpy.int64)
+    num_activ = len(activs)
+
+    # targets need <order> preceding events in the same case
+    _, grams = get_ngrams(codes, offsets, order + 1)
+
+    if order == 1:
+        srcs = grams[:, 0]
+        src_labels = activs
+    else:
+        ngrams, srcs = numpy.unique(grams[:, :-1], axis=0, return_inverse=True)
+        srcs = srcs.reshape(-1)
+        src_labels = [ tuple(activs[ngram]) for ngram in ngrams ]
+
+    # count (src, tgt) pairs in a single pass
+    num_src = len(src_labels)
+    pairs, counts = numpy.unique(srcs * num_activ + grams[:, -1], return_counts=True)
+    transit_matrix = scipy.sparse.csr_matrix((counts, (pairs // num_activ, pairs % num_activ)), shape=(num_src, num_activ))
+
+    if normalize_axis is not None:
+        transit_matrix = sklearn.preprocessing.normalize(transit_matrix, norm="l1", axis=normalize_axis)
+
+    return transit_matrix, src_labels, activs
+
+
+# windows of n consecutive events within the same case
+# returns position of each window's last event & the windows (one per row)
+def get_ngrams(codes, offsets, n):
+    lengths = numpy.diff(offsets)
+    in_case = numpy.arange(len(codes)) - numpy.repeat(offsets[:-1], lengths)
+    ends = numpy.flatnonzero(in_case >= n - 1)
+    return ends, numpy.stack([ codes[ends - n + 1 + i] for i in range(n) ], axis=1)
+
+
 def num_cases(log):
     return len(log['case:concept:name'].unique())
 
 
-def eval_metrics(log, net, init_marking, final_marking, show_progress_bar=True):
-    print("getting metrics")
+@instrument
+def eval_metrics(log, net, init_marking, final_marking, show_progress_bar=True, verbose=True):
+    if verbose:
+        report("getting metrics")
     metrics = general_evaluation.apply(log, net, init_marking, final_marking, parameters={ 'show_progress_bar': show_progress_bar } )
     return { 
         'fscore': metrics['fscore'],
@@ -108,33 +176,243 @@ def eval_metrics(log, net, init_marking, final_marking, show_progress_bar=True):
     }
 
 
-def eval_cluster_metrics(log, sublogs, miner_fn, show_progress_bar=True):
-    print("\n> evaluating sublog metrics")
+# evaluate once per unique variant, weighted by variant frequency
+# (variants: as per variant_stats.get_variants; computed if not given)
+# (coverage: only evaluate the most frequent variants that cover this percentage (0-100) of cases, like get_covering_variants)
+# without coverage, metrics equal those of eval_metrics up to float rounding (< 1e-9)
+# (if events with equal timestamps are in activity order; get_variants orders such ties on activity, not on log row)
+# with coverage, they are an approximation over the covered cases
+@instrument
+def eval_metrics_variants(log, net, init_marking, final_marking, variants=None, coverage=None, show_progress_bar=True, verbose=True):
+    if verbose:
+        report("getting metrics (per variant)")
+    if variants is None:
+        variants = get_variants(log)
+
+    variants = sorted(variants.items(), key=lambda v: v[1], reverse=True)
+    if coverage is not None:
+        if not 0 < coverage <= 100:
+            raise ValueError(f"coverage is a percentage (0-100], got {coverage}")
+        cumul_counts = numpy.cumsum([ cnt for _, cnt in variants ])
+        variants = variants[:numpy.searchsorted(cumul_counts, coverage / 100 * cumul_counts[-1]) + 1]
+    sequences = [ seq for seq, _ in variants ]
+    counts = [ cnt for _, cnt in variants ]
+
+    var_log = EventLog([ Trace([ Event({ 'concept:name': activ }) for activ in seq ]) for seq in sequences ])
+    replayed = token_replay.apply(var_log, net, init_marking, final_marking,
+                                  parameters={ token_replay.Parameters.SHOW_PROGRESS_BAR: show_progress_bar })
+
+    # (same as pm4py's token replay fitness, but with weighted traces)
+    totals = { key: sum(trace[key] * cnt for trace, cnt in zip(replayed, counts)) 
+              for key in [ 'missing_tokens', 'consumed_tokens', 'remaining_tokens', 'produced_tokens' ] }
+    log_fitness = 0
+    if totals['consumed_tokens'] > 0 and totals['produced_tokens'] > 0:
+        log_fitness = 0.5 * (1 - totals['missing_tokens'] / totals['consumed_tokens']) + \
+            0.5 * (1 - totals['remaining_tokens'] / totals['produced_tokens'])
+
+    precision = precision_variants(sequences, counts, net, init_marking, final_marking, show_progress_bar)
+
+    # (same as pm4py's token-based generalization, but with weighted traces)
+    trans_occ = Counter()
+    for trace, cnt in zip(replayed, counts):
+        for trans in trace['activated_transitions']:
+            trans_occ[trans] += cnt
+    generalization = 1.0
+    if len(net.transitions) > 0:
+        inv_sq_occ_sum = sum(1.0 / math.sqrt(occ) for occ in trans_occ.values()) + \
+            len([ trans for trans in net.transitions if trans not in trans_occ ])
+        generalization = 1.0 - inv_sq_occ_sum / float(len(net.transitions))
+
+    fscore = 0.0
+    if log_fitness + precision > 0:
+        fscore = (2 * log_fitness * precision) / (log_fitness + precision)
+
+    return { 
+        'fscore': fscore,
+        'log_fitness': log_fitness,
+        'precision': precision,
+        'generalization': generalization,
+        'simplicity': simplicity_arc_degree.apply(net)
+    }
+
+
+# (same as pm4py's etconformance precision, but with weighted prefixes)
+@instrument
+def precision_variants(sequences, counts, net, init_marking, final_marking, show_progress_bar=True):
+    prefixes = {}; prefix_count = Counter()
+    for seq, cnt in zip(sequences, counts):
+        for i in range(1, len(seq)):
+            prefix = pm4py_constants.DEFAULT_VARIANT_SEP.join(seq[0:i])
+            prefixes.setdefault(prefix, set()).add(seq[i])
+            prefix_count[prefix] += cnt
+    prefix_keys = list(prefixes.keys())
+
+    replayed = token_replay.apply(precision_utils.form_fake_log(prefix_keys), net, init_marking, final_marking, parameters={
+        token_replay.Parameters.SHOW_PROGRESS_BAR: show_progress_bar,
+        token_replay.Parameters.CONSIDER_REMAINING_IN_FITNESS: False,
+        token_replay.Parameters.TRY_TO_REACH_FINAL_MARKING_THROUGH_HIDDEN: False,
+        token_replay.Parameters.STOP_IMMEDIATELY_UNFIT: True,
+        token_replay.Parameters.WALK_THROUGH_HIDDEN_TRANS: True,
+        token_replay.Parameters.CLEANING_TOKEN_FLOOD: False,
+    })
+
+    # also the empty prefix should be counted
+    start_activs = set(seq[0] for seq in sequences if len(seq) > 0)
+    trans_en_ini = set(trans.label for trans in get_visible_transitions_eventually_enabled_by_marking(net, init_marking))
+    num_traces = sum(counts)
+    sum_at = num_traces * len(trans_en_ini)
+    sum_ee = num_traces * len(trans_en_ini.difference(start_activs))
+
+    for prefix, trace in zip(prefix_keys, replayed):
+        if trace['trace_is_fit']:
+            activated = set(trans.label for trans in trace['enabled_transitions_in_marking'] if trans.label is not None)
+            sum_at += len(activated) * prefix_count[prefix]
+            sum_ee += len(activated.difference(prefixes[prefix])) * prefix_count[prefix]
+
+    return 1 - float(sum_ee) / float(sum_at) if sum_at > 0 else 1.0
+
+
+# full log is shared read-only with workers
+# (inherited when forking; otherwise sent once per worker, not per task)
+_shared_log = None
+_shared_variants = None
+
+def _init_eval_worker(log, variants=None):
+    global _shared_log, _shared_variants
+    _shared_log = log
+    _shared_variants = variants
+
+
+# mine sublog (or full log, if None) & evaluate it against the full log
+def _eval_sublog(label, sublog, miner_fn, show_progress_bar, verbose, coverage=None):
+    log = _shared_log
+    mined_log = log if sublog is None else sublog
+    if verbose:
+        report(f"{label} (num cases: {num_cases(mined_log)})")
+
+    start = time.perf_counter()
+    net, init_marking, final_marking = miner_fn(mined_log)
+    mine_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if _shared_variants is not None:
+        metrics = eval_metrics_variants(log, net, init_marking, final_marking, variants=_shared_variants, 
+                                        coverage=coverage, show_progress_bar=show_progress_bar, verbose=False)
+    else:
+        metrics = eval_metrics(log, net, init_marking, final_marking, show_progress_bar=show_progress_bar, verbose=False)
+    eval_time = time.perf_counter() - start
+
+    return { 'sublog': label, 'num_cases': num_cases(mined_log), **metrics, 'mine_time': mine_time, 'eval_time': eval_time }
+
+
+# returns dataframe with metrics & timings of the original log & each sublog
+# (workers: # processes; None evaluates sequentially)
+# (with workers, miner_fn must be picklable, i.e., a module-level function)
+# (per_variant: use eval_metrics_variants, with optional coverage)
+@instrument
+def eval_cluster_metrics(log, sublogs, miner_fn, show_progress_bar=True, workers=None, verbose=True, per_variant=False, coverage=None):
+    if verbose:
+        report("\n> evaluating sublog metrics")
+
+    tasks = [ ('original', None) ] + [ (cnt, sublog) for cnt, sublog in enumerate(sublogs) ]
+    # (variants of full log only need to be computed once)
+    variants = get_variants(log) if per_variant else None
+
+    # (always release the shared log, also on errors)
+    try:
+        if workers is None:
+            _init_eval_worker(log, variants)
+            results = []
+            for label, sublog in tasks:
+                results.append(_eval_sublog(label, sublog, miner_fn, show_progress_bar, verbose, coverage))
+                report(f"evaluated {label}", len(results), len(tasks))
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                _init_eval_worker(log, variants)
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            else:
+                pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_eval_worker, initargs=(log, variants))
+            with pool:
+                futures = [ pool.submit(_eval_sublog, label, sublog, miner_fn, False, verbose, coverage) for label, sublog in tasks ]
+                results = []
+                for (label, _), future in zip(tasks, futures):
+                    results.append(future.result())
+                    report(f"evaluated {label}", len(results), len(tasks))
+    finally:
+        _init_eval_worker(None)
+
+    results = pd.DataFrame(results)
+    if verbose:
+        report(f"avg fscore: {results['fscore'].iloc[1:].mean()}")
+    return results
+
+
+# - trace clustering
+# (clusters unique variants, weighted by # cases, instead of cases; see variant_features)
+
+# returns sublogs (one per non-empty cluster; ready for eval_cluster_metrics) & per-stage timings (s)
+# - features: 'activities' (bags), 'edges' (directly-follows), 'ngrams' (of length ngram)
+# - batch_size: MiniBatchKMeans mini-batch size
+# (index: TraceIndex of log, if already built)
+@instrument
+def cluster_traces(log, n_clusters, features=( 'activities', 'edges' ), ngram=3, batch_size=4096, seed=0, index=None):
+    timings = {}
+
+    with span("cluster_traces.index") as record:
+        index = TraceIndex.from_log(log) if index is None else index
+        index.check_log(log)
+    timings['index'] = record['wall']
+
+    with span("cluster_traces.features") as record:
+        matrix = variant_features(index, features, ngram)
+        weights = index.variant_counts()
+    timings['features'] = record['wall']
+
+    with span("cluster_traces.cluster") as record:
+        clusterer = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=seed, n_init='auto')
+        variant_labels = clusterer.fit_predict(matrix, sample_weight=weights)
+    timings['cluster'] = record['wall']
+
+    with span("cluster_traces.split") as record:
+        case_labels = variant_labels[index.variant_ids]
+        row_labels = index.case_to_rows(case_labels)
+        sublogs = [ log[row_labels == label] for label in numpy.unique(case_labels) ]
+    timings['split'] = record['wall']
 
-    print("mining original process")
-    net, init_marking, final_marking = miner_fn(log)
-    print("getting metrics")
-    metrics = eval_metrics(log, net, init_marking, final_marking, show_progress_bar=show_progress_bar)
-    print("\noriginal log")
-    print(f"(num cases: {num_cases(log)})")
-    print(metrics)
-    print()
+    return sublogs, timings
 
-    cnt = 0
-    total_fscore = 0
 
-    for sublog in sublogs:
-        print("sublog", cnt)
-        print(f"(num cases: {num_cases(sublog)})")
+# sparse feature matrix; a row per variant (in variant id order), l2-normalized
+# (from the events of one case per variant)
+def variant_features(index, features=( 'activities', 'edges' ), ngram=3):
+    codes, offsets = index.variant_events()
+    codes = codes.astype(numpy.int64)
+    num_variants = len(offsets) - 1
+    rows = numpy.repeat(numpy.arange(num_variants), numpy.diff(offsets))
 
-        print("mining subprocess")
-        sub_net, sub_init_marking, sub_final_marking = miner_fn(sublog)
+    blocks = []
+    for feature in features:
+        match feature:
+            case 'activities':
+                n = 1
+            case 'edges':
+                n = 2
+            case 'ngrams':
+                n = ngram
+            case _:
+                raise ValueError(f"Unsupported feature: {feature}")
+        # (same windows as codes_to_transit_matrix, but counted per variant)
+        ends, grams = get_ngrams(codes, offsets, n)
+        blocks.append(count_features(rows[ends], grams, num_variants))
 
-        metrics = eval_metrics(log, sub_net, sub_init_marking, sub_final_marking, show_progress_bar=show_progress_bar)
-        print(metrics)
-        print()
+    matrix = scipy.sparse.hstack(blocks, format='csr')
+    return sklearn.preprocessing.normalize(matrix, norm='l2', axis=1)
 
-        cnt += 1
-        total_fscore += metrics['fscore']
 
-    print("avg fscore:", total_fscore / cnt)
\ No newline at end of file
+# counts of each distinct key (row of keys) per row, as sparse matrix
+def count_features(rows, keys, num_rows):
+    _, cols = numpy.unique(keys, axis=0, return_inverse=True)
+    cols = cols.reshape(-1)
+    num_cols = int(cols.max()) + 1 if len(cols) > 0 else 0
+    matrix = scipy.sparse.coo_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(num_rows, num_cols))
+    return matrix.tocsr() # (sums duplicates)
@@ -0,0 +1,108 @@
+import pandas as pd
+import numpy as np
+
+# compact in-memory logs (see compact_log) & helpers that avoid whole-frame copies on them
+# - case & activity columns: categoricals (i.e., int8/16/32 codes & a single copy of each name)
+#   (integer case ids are downcast instead; keeps their numeric order)
+# - other string columns: categoricals, if their values repeat (see max_unique_ratio)
+# - numeric columns: downcast to the smallest integer type, or to float32 if lossless
+# - timestamps: datetime64 (8 bytes/event, i.e., int64 under the hood)
+# (memory_report: bytes per column, e.g., to compare before & after)
+
+key_cols = [ 'case:concept:name', 'concept:name' ]
+
+def compact_log(log, max_unique_ratio=0.5):
+    columns = {}
+    for col in log.columns:
+        series = log[col]
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(series.dtype):
+            continue
+        if col == 'time:timestamp' and not pd.api.types.is_datetime64_any_dtype(series.dtype):
+            columns[col] = pd.to_datetime(series)
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            columns[col] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series.dtype):
+            values = series.to_numpy()
+            downcast = values.astype(np.float32)
+            if np.array_equal(downcast, values, equal_nan=True):
+                columns[col] = pd.Series(downcast, index=series.index, name=col)
+        elif pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype):
+            if col in key_cols or series.nunique() <= max_unique_ratio * len(series):
+                columns[col] = series.astype('category')
+
+    # (only replaces the converted columns)
+    return log.assign(**columns)
+
+
+# bytes per column (deep; includes the strings of object columns)
+def memory_report(log):
+    usage = log.memory_usage(index=True, deep=True)
+    dtypes = pd.Series({ 'Index': log.index.dtype, **log.dtypes.to_dict() }).astype(str)
+    return pd.DataFrame({ 'dtype': dtypes, 'bytes': usage, 'perc': (usage / max(usage.sum(), 1) * 100).round(2) })
+
+
+# - helpers
+
+# values that compare equal iff the column's values do
+# (codes for categoricals; avoids comparing the names)
+def column_codes(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy()
+    return series.to_numpy()
+
+
+# per row, position of its value in values (or -1)
+# (for categoricals, only looks up the categories)
+def lookup_codes(series, values):
+    index = pd.Index(pd.unique(pd.Series(values)))
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        return np.where(codes >= 0, index.get_indexer(series.cat.categories)[codes], -1)
+    return index.get_indexer(series)
+
+
+# copy of the column, with value at the given positions
+def replace_at(series, positions, value):
+    if isinstance(series.dtype, pd.CategoricalDtype) and value not in series.cat.categories:
+        series = series.cat.add_categories([ value ])
+    else:
+        series = series.copy()
+    series.iloc[positions] = value
+    return series
+
+
+# (for categoricals, only renames the categories)
+def add_suffix(series, suffix):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.rename_categories(lambda name: f"{name}{suffix}")
+    return series + suffix
+
+
+# stable sort on the given columns; the log itself if already sorted
+# (only checked for categorical, numeric & datetime columns without missing values; otherwise, always sorts)
+def sort_events(log, by):
+    keys = [ sort_key(log[col]) for col in by ]
+    if all(key is not None for key in keys) and is_sorted(keys):
+        return log
+    return log.sort_values(by=by, kind='stable')
+
+
+def sort_key(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # (categoricals sort on their codes)
+        codes = series.cat.codes.to_numpy()
+        return codes if not (codes < 0).any() else None
+    if pd.api.types.is_datetime64_any_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy() if not series.hasnans else None
+    return None
+
+
+def is_sorted(keys):
+    # (rows whose order isn't decided by the prior keys)
+    tied = np.ones(max(len(keys[0]) - 1, 0), dtype=bool)
+    for key in keys:
+        prev, cur = key[:-1], key[1:]
+        if (tied & (cur < prev)).any():
+            return False
+        tied &= cur == prev
+    return True
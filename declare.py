@@ -0,0 +1,334 @@
+import pandas as pd
+import numpy as np
+from trace_index import get_trace_index
+from instrument import instrument
+
+# Declare constraints: discovery & checking over the integer-encoded traces
+# (each variant is evaluated once & weighted by its # cases; all activity pairs at once)
+# - support: share of cases in which the constraint holds (incl. vacuously, i.e., when it isn't activated)
+# - confidence: share of the activated cases in which it holds
+# - cases: # activated cases
+#   (unary: all cases, so confidence = support; response-like & not-succession: cases with a;
+#    precedence-like: cases with b; succession-like & (not) co-existence: cases with a or b)
+# (pairs that are never activated are left out)
+# (.decl: as written by RuM; see graphs/*.decl)
+
+unary_templates = [ 'Existence', 'Existence2', 'Existence3', 'Absence', 'Absence2', 'Absence3',
+                    'Exactly1', 'Exactly2', 'Init', 'End' ]
+binary_templates = [ 'Responded Existence', 'Co-Existence', 'Response', 'Precedence', 'Succession',
+                     'Alternate Response', 'Alternate Precedence', 'Alternate Succession',
+                     'Chain Response', 'Chain Precedence', 'Chain Succession',
+                     'Not Co-Existence', 'Not Succession', 'Not Chain Succession' ]
+
+# (log can also be a TraceIndex)
+# (chunksize: max # (event, activity) checks at once; bounds memory)
+@instrument
+def discover_declare(log, templates=None, min_support=0.0, min_confidence=0.0, chunksize=5_000_000):
+    templates = unary_templates + binary_templates if templates is None else list(templates)
+    unknown = [ template for template in templates if template not in unary_templates + binary_templates ]
+    if len(unknown) > 0:
+        raise ValueError(f"Unsupported templates: {', '.join(unknown)}")
+
+    index = get_trace_index(log)
+    traces = VariantTraces(index)
+
+    tables = []
+    if any(template in unary_templates for template in templates):
+        tables.append(unary_table(traces, index.activities))
+    if any(template in binary_templates for template in templates):
+        tables.append(binary_table(traces, index.activities, chunksize))
+    table = pd.concat(tables, ignore_index=True)
+
+    table = table[table['template'].isin(templates) & (table['support'] >= min_support) & (table['confidence'] >= min_confidence)]
+    # (in order of templates; then most supported first)
+    order = np.lexsort((-table['support'].to_numpy(), pd.Index(templates).get_indexer(table['template'])))
+    return table.iloc[order].reset_index(drop=True)
+
+
+# support & confidence of the given constraints (template, a, b) in the log
+# (model: dataframe or path to .decl)
+# (unsupported templates get NaN; constraints on activities outside the log hold only vacuously)
+@instrument
+def check_declare(log, model, chunksize=5_000_000):
+    model = read_decl(model) if isinstance(model, str) else model[[ 'template', 'a', 'b' ]]
+    templates = [ template for template in pd.unique(model['template']) if template in unary_templates + binary_templates ]
+    table = discover_declare(log, templates, chunksize=chunksize) if len(templates) > 0 \
+        else pd.DataFrame(columns=[ 'template', 'a', 'b', 'support', 'confidence', 'cases' ])
+
+    # (b is None for unary constraints)
+    keys = lambda df: list(zip(df['template'], df['a'], df['b'].where(df['b'].notna(), None)))
+    found = table.set_index(pd.MultiIndex.from_tuples(keys(table)))[[ 'support', 'confidence', 'cases' ]] if len(table) > 0 \
+        else pd.DataFrame(columns=[ 'support', 'confidence', 'cases' ])
+    result = found.reindex(pd.MultiIndex.from_tuples(keys(model))).set_axis(model.index)
+
+    # not found: never activated (binary) or absent activity (unary)
+    missing = result['support'].isna() & model['template'].isin(templates)
+    holds_vacuously = ~model['template'].isin(unary_templates) | model['template'].isin([ 'Absence', 'Absence2', 'Absence3' ])
+    result.loc[missing, 'support'] = np.where(holds_vacuously[missing], 1.0, 0.0)
+    result.loc[missing, 'cases'] = 0
+    return pd.concat([ model, result ], axis=1)
+
+
+# - encoded traces
+
+# one trace per variant, with the distinct activities ("entries") of each variant
+# - events, offsets: CSR layout of the variant traces; weights: # cases per variant
+# - per event: variant, position, entry, next & prior position of the same activity (or length, -1)
+# - per entry: variant, activity, # occurrences, first & last position, range in sorted_pos
+# - sorted_key, sorted_pos: events sorted on (variant, activity, position), to binary search the occurrences
+class VariantTraces:
+
+    def __init__(self, index):
+        self.num_activs = len(index.activities)
+        events, self.offsets = index.variant_events()
+        self.events = events.astype(np.int64)
+        self.weights = index.variant_counts().astype(np.float64)
+        self.lengths = np.diff(self.offsets)
+
+        num_events = len(self.events)
+        self.variant = np.repeat(np.arange(self.num_variants), self.lengths)
+        self.pos = np.arange(num_events) - self.offsets[self.variant]
+
+        # (stable: positions stay in order per activity)
+        groups = self.variant * self.num_activs + self.events
+        order = np.argsort(groups, kind='stable')
+        sorted_groups = groups[order]
+        self.sorted_pos = self.pos[order]
+        self.sorted_key = sorted_groups * (int(self.lengths.max(initial=0)) + 1) + self.sorted_pos
+
+        self.entry_start = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]) if num_events > 0 else np.zeros(0, dtype=np.int64)
+        self.entry_end = np.r_[self.entry_start[1:], num_events].astype(np.int64)
+        self.entry_variant = self.variant[order[self.entry_start]]
+        self.entry_activ = self.events[order[self.entry_start]]
+        self.entry_count = self.entry_end - self.entry_start
+        self.entry_first = self.sorted_pos[self.entry_start]
+        self.entry_last = self.sorted_pos[self.entry_end - 1]
+
+        self.entry = np.empty(num_events, dtype=np.int64)
+        self.entry[order] = np.repeat(np.arange(len(self.entry_start)), self.entry_count)
+        # (entries are sorted on variant)
+        self.entry_offsets = np.r_[0, np.cumsum(np.bincount(self.entry_variant, minlength=self.num_variants))].astype(np.int64)
+        self.num_entries = np.diff(self.entry_offsets)
+
+        next_same = np.r_[self.sorted_pos[1:], 0]
+        next_same[self.entry_end - 1] = self.lengths[self.entry_variant]
+        prev_same = np.r_[0, self.sorted_pos[:-1]]
+        prev_same[self.entry_start] = -1
+        self.next_same = np.empty(num_events, dtype=np.int64); self.next_same[order] = next_same
+        self.prev_same = np.empty(num_events, dtype=np.int64); self.prev_same[order] = prev_same
+
+    @property
+    def num_variants(self):
+        return len(self.weights)
+
+    @property
+    def num_cases(self):
+        return self.weights.sum()
+
+    # cases per activity
+    def activ_weights(self):
+        return np.bincount(self.entry_activ, weights=self.weights[self.entry_variant], minlength=self.num_activs)
+
+    # next & prior occurrence of each entry's activity, from the given events
+    # (length & -1 if none)
+    def occurrences(self, events, entries):
+        keys = self.sorted_key[self.entry_start[entries]] - self.entry_first[entries] + self.pos[events]
+        after = np.searchsorted(self.sorted_key, keys, side='right')
+        before = np.searchsorted(self.sorted_key, keys, side='left') - 1
+        nexts = np.where(after < self.entry_end[entries], self.sorted_pos[np.minimum(after, len(self.sorted_pos) - 1)], self.lengths[self.variant[events]])
+        prevs = np.where(before >= self.entry_start[entries], self.sorted_pos[np.maximum(before, 0)], -1)
+        return nexts, prevs
+
+
+# - unary templates
+# (from the # occurrences per variant & activity)
+
+def unary_table(traces, activities):
+    def per_activ(entries):
+        return np.bincount(traces.entry_activ[entries], weights=traces.weights[traces.entry_variant[entries]], minlength=traces.num_activs)
+
+    counts = traces.entry_count
+    num_cases = traces.num_cases
+    non_empty = np.flatnonzero(traces.lengths > 0)
+    firsts, lasts = traces.events[traces.offsets[non_empty]], traces.events[traces.offsets[non_empty + 1] - 1]
+    holds = { 'Existence': per_activ(counts >= 1),
+              'Existence2': per_activ(counts >= 2),
+              'Existence3': per_activ(counts >= 3),
+              'Absence': num_cases - per_activ(counts >= 1),
+              'Absence2': num_cases - per_activ(counts >= 2),
+              'Absence3': num_cases - per_activ(counts >= 3),
+              'Exactly1': per_activ(counts == 1),
+              'Exactly2': per_activ(counts == 2),
+              'Init': np.bincount(firsts, weights=traces.weights[non_empty], minlength=traces.num_activs),
+              'End': np.bincount(lasts, weights=traces.weights[non_empty], minlength=traces.num_activs) }
+
+    support = np.concatenate(list(holds.values())) / max(num_cases, 1)
+    return pd.DataFrame({ 'template': np.repeat(list(holds), traces.num_activs),
+                          'a': np.tile(activities, len(holds)), 'b': None,
+                          'support': support, 'confidence': support,
+                          'cases': np.full(len(support), int(num_cases)) })
+
+
+# - binary templates
+# per occurrence of a (activation), for each other activity b of the variant:
+#   next b (response: any; alternate: before the next a; chain: right after)
+#   prior b (precedence of a by b: any; alternate: after the prior a; chain: right before)
+# per variant, a template holds for (a, b) if it holds for all activations
+# (pairs of activities that don't co-occur in a variant are settled by the activity weights)
+
+def binary_table(traces, activities, chunksize=5_000_000):
+    num_activs = traces.num_activs
+    sums = { name: np.zeros(num_activs * num_activs) for name in [ 'both', 'response', 'precedence', 'succession',
+                                                                     'alt_response', 'alt_precedence', 'alt_succession',
+                                                                     'chain_response', 'chain_precedence', 'chain_succession',
+                                                                     'not_succession', 'not_chain_succession' ] }
+    for start, end in variant_chunks(traces, chunksize):
+        for name, values in pair_holds(traces, start, end).items():
+            sums[name] += values
+
+    num_cases = traces.num_cases
+    w_a = traces.activ_weights()
+    w_a, w_b, w_ab = np.repeat(w_a, num_activs), np.tile(w_a, num_activs), sums['both']
+    w_or = w_a + w_b - w_ab
+    # template: (activated cases, activated cases where it holds)
+    weights = { 'Responded Existence': (w_a, w_ab),
+                'Co-Existence': (w_or, w_ab),
+                'Response': (w_a, sums['response']),
+                'Precedence': (w_b, sums['precedence']),
+                'Succession': (w_or, sums['succession']),
+                'Alternate Response': (w_a, sums['alt_response']),
+                'Alternate Precedence': (w_b, sums['alt_precedence']),
+                'Alternate Succession': (w_or, sums['alt_succession']),
+                'Chain Response': (w_a, sums['chain_response']),
+                'Chain Precedence': (w_b, sums['chain_precedence']),
+                'Chain Succession': (w_or, sums['chain_succession']),
+                'Not Co-Existence': (w_or, w_or - w_ab),
+                'Not Succession': (w_a, w_a - w_ab + sums['not_succession']),
+                'Not Chain Succession': (w_a, w_a - w_ab + sums['not_chain_succession']) }
+
+    pair_a, pair_b = np.repeat(np.arange(num_activs), num_activs), np.tile(np.arange(num_activs), num_activs)
+    tables = []
+    for template, (activated, holds) in weights.items():
+        keep = np.flatnonzero((activated > 0) & (pair_a != pair_b))
+        tables.append(pd.DataFrame({ 'template': template, 'a': activities[pair_a[keep]], 'b': activities[pair_b[keep]],
+                                     'support': (num_cases - activated[keep] + holds[keep]) / num_cases,
+                                     'confidence': holds[keep] / activated[keep],
+                                     'cases': np.round(activated[keep]).astype(np.int64) }))
+    return pd.concat(tables, ignore_index=True)
+
+
+# ranges of variants with at most chunksize (event, entry) pairs
+# (a larger variant gets a chunk of its own)
+def variant_chunks(traces, chunksize):
+    cumul = np.cumsum(traces.lengths * traces.num_entries)
+    start = 0
+    while start < traces.num_variants:
+        prior = cumul[start - 1] if start > 0 else 0
+        end = max(int(np.searchsorted(cumul, prior + chunksize, side='right')), start + 1)
+        yield start, end
+        start = end
+
+
+# per pair of activities (a * num_activs + b), the cases in variants [start, end) where a template holds
+# (only variants where both a & b occur)
+def pair_holds(traces, start, end):
+    num_activs = traces.num_activs
+    entry_offsets, num_entries = traces.entry_offsets, traces.num_entries
+
+    # (event, entry) checks, for all events & entries of the same variant
+    events = np.arange(traces.offsets[start], traces.offsets[end])
+    per_event = num_entries[traces.variant[events]]
+    check_events = np.repeat(events, per_event)
+    within = np.arange(len(check_events)) - np.repeat(np.cumsum(per_event) - per_event, per_event)
+    check_entries = entry_offsets[traces.variant[check_events]] + within
+
+    # (entry, entry) pairs of the chunk; pair ids in the same layout as the checks, i.e., per (entry of event, other entry)
+    entries = np.arange(entry_offsets[start], entry_offsets[end])
+    per_entry = num_entries[traces.entry_variant[entries]]
+    pair_offsets = np.r_[0, np.cumsum(per_entry)]
+    pair_first = np.repeat(entries, per_entry)
+    pair_second = entry_offsets[traces.entry_variant[pair_first]] + np.arange(len(pair_first)) - np.repeat(pair_offsets[:-1], per_entry)
+    num_pairs = len(pair_first)
+
+    check_pairs = pair_offsets[traces.entry[check_events] - entries[0]] + within if len(entries) > 0 else within
+    other = check_entries != traces.entry[check_events]
+    check_events, check_entries, check_pairs = check_events[other], check_entries[other], check_pairs[other]
+
+    nexts, prevs = traces.occurrences(check_events, check_entries)
+    pos = traces.pos[check_events]
+    lengths = traces.lengths[traces.variant[check_events]]
+    count = lambda mask: np.bincount(check_pairs[mask], minlength=num_pairs)
+    # (a = activity of the event; b = activity of the entry)
+    after = count(nexts < lengths)
+    alt_after = count(nexts < traces.next_same[check_events])
+    chain_after = count((nexts == pos + 1) & (nexts < lengths))
+    # (b preceded by a, with a the entry's activity & b the event's)
+    before = count(prevs >= 0)
+    alt_before = count(prevs > traces.prev_same[check_events])
+    chain_before = count((prevs == pos - 1) & (prevs >= 0))
+
+    # per pair (a, b): the checks from a's events, and from b's events (i.e., the transposed pair)
+    transposed = pair_offsets[pair_second - entries[0]] + (pair_first - entry_offsets[traces.entry_variant[pair_first]]) if num_pairs > 0 else pair_first
+    count_a, count_b = traces.entry_count[pair_first], traces.entry_count[pair_second]
+    response = after == count_a
+    precedence = before[transposed] == count_b
+    alt_response = alt_after == count_a
+    alt_precedence = alt_before[transposed] == count_b
+    chain_response = chain_after == count_a
+    chain_precedence = chain_before[transposed] == count_b
+
+    codes = traces.entry_activ[pair_first] * num_activs + traces.entry_activ[pair_second]
+    weights = np.where(pair_first != pair_second, traces.weights[traces.entry_variant[pair_first]], 0.0)
+    total = lambda holds: np.bincount(codes, weights=weights * holds, minlength=num_activs * num_activs)
+    return { 'both': total(True),
+             'response': total(response), 'precedence': total(precedence), 'succession': total(response & precedence),
+             'alt_response': total(alt_response), 'alt_precedence': total(alt_precedence),
+             'alt_succession': total(alt_response & alt_precedence),
+             'chain_response': total(chain_response), 'chain_precedence': total(chain_precedence),
+             'chain_succession': total(chain_response & chain_precedence),
+             'not_succession': total(after == 0), 'not_chain_succession': total(chain_after == 0) }
+
+
+# - .decl files
+# activity lines, then a line per constraint: <template>[<a>] | | or <template>[<a>, <b>] | | |
+# (activation, target & time conditions are left empty)
+
+def write_decl(constraints, path, activities=None):
+    if activities is None:
+        activities = pd.unique(pd.concat([ constraints['a'], constraints['b'].dropna() ]))
+    with open(path, "w") as f:
+        for activ in activities:
+            f.write(f"activity {activ}\n")
+        for template, a, b in constraints[[ 'template', 'a', 'b' ]].itertuples(index=False):
+            if pd.isna(b):
+                f.write(f"{template}[{a}] | |\n")
+            else:
+                f.write(f"{template}[{a}, {b}] | | |\n")
+
+
+# constraints (template, a, b) of a .decl file
+# (activity names may contain ", " or brackets; the activity lines decide where a pair is split)
+def read_decl(path):
+    activities, constraints = set(), []
+    with open(path) as f:
+        lines = [ line.rstrip("\n") for line in f if line.strip() != "" ]
+
+    for line in lines:
+        if line.startswith("activity "):
+            activities.add(line[len("activity "):])
+
+    for line in lines:
+        if line.startswith("activity "):
+            continue
+        head = line.split(" |")[0].strip()
+        template, args = head[:head.index("[")], head[head.index("[") + 1:-1]
+        if template in unary_templates:
+            constraints.append((template, args, None))
+        else:
+            splits = [ i for i in range(len(args)) if args.startswith(", ", i) ]
+            split = next((i for i in splits if args[:i] in activities and args[i + 2:] in activities), splits[0] if len(splits) > 0 else None)
+            if split is None:
+                raise ValueError(f"Not a binary constraint: {line}")
+            constraints.append((template, args[:split], args[split + 2:]))
+
+    return pd.DataFrame(constraints, columns=[ 'template', 'a', 'b' ])
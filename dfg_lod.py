@@ -0,0 +1,74 @@
+import numpy as np
+import heapq
+
+# level-of-detail dfgs, for large graphs that are unreadable (& slow to lay out) in full
+# per coverage (%): the most frequent edges that cover coverage % of the flow (i.e., of all directly-follows occurrences),
+# plus the widest paths (i.e., with the highest bottleneck frequency) from the start to each of their activities,
+# and from each of them to the end; so, every level stays connected from start to end
+# (all levels come from one sort of the edges & one widest-path tree in each direction)
+
+def get_lod_dfgs(dfg, start_activities, end_activities, coverages=(50, 80, 95)):
+    edges = sorted(dfg, key=lambda edge: -dfg[edge])
+    cumul = np.cumsum([ dfg[edge] for edge in edges ], dtype=np.float64)
+    total = cumul[-1] if len(cumul) > 0 else 0
+
+    from_start = widest_tree(dfg, start_activities, reverse=False)
+    to_end = widest_tree(dfg, end_activities, reverse=True)
+
+    levels = {}
+    for coverage in coverages:
+        # (smallest top-k reaching the coverage)
+        num = min(int(np.searchsorted(cumul, total * coverage / 100, side='left')) + 1, len(edges))
+        kept = set(edges[:num])
+        activities = { activ for edge in kept for activ in edge }
+        for activ in activities:
+            kept.update(tree_path(from_start, activ))
+            kept.update(tree_path(to_end, activ))
+        levels[coverage] = { edge: dfg[edge] for edge in edges if edge in kept }
+    return levels
+
+
+# per activity, its parent on the widest path from the (start) activities
+# (edges reversed: paths to the (end) activities; parents are then successors)
+# (like dijkstra, but maximizing the minimum edge frequency along the path)
+def widest_tree(dfg, activities, reverse=False):
+    succs = {}
+    for (src, tgt), count in dfg.items():
+        src, tgt = (tgt, src) if reverse else (src, tgt)
+        succs.setdefault(src, []).append((tgt, count))
+
+    width = { activ: count for activ, count in activities.items() }
+    parents = { activ: None for activ in activities }
+    heap = [ (-count, activ) for activ, count in width.items() ]
+    heapq.heapify(heap)
+    done = set()
+    while len(heap) > 0:
+        neg_width, activ = heapq.heappop(heap)
+        if activ in done:
+            continue
+        done.add(activ)
+        for succ, count in succs.get(activ, []):
+            new_width = min(-neg_width, count)
+            if succ not in done and new_width > width.get(succ, 0):
+                width[succ] = new_width
+                parents[succ] = activ
+                heapq.heappush(heap, (-new_width, succ))
+
+    return { 'parents': parents, 'reverse': reverse }
+
+
+# dfg edges of the tree path to activ (none if activ isn't reachable)
+def tree_path(tree, activ):
+    parents, path = tree['parents'], []
+    while activ in parents and parents[activ] is not None:
+        parent = parents[activ]
+        path.append((activ, parent) if tree['reverse'] else (parent, activ))
+        activ = parent
+    return path
+
+
+# activities, edges & % of the flow shown in a level
+def level_stats(dfg, level):
+    total = sum(dfg.values())
+    return { 'activities': len({ activ for edge in level for activ in edge }), 'edges': len(level),
+             'flow': round(100 * sum(level.values()) / total, 2) if total > 0 else 100.0 }
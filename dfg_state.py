@@ -0,0 +1,189 @@
+import pandas as pd
+import numpy as np
+import pickle
+from collections import Counter
+from pm4py.visualization.dfg import visualizer as dfg_visualizer
+from mine_utils import ProcAnn, mine_vis
+from variant_stats import variants_to_stats
+
+# directly-follows & variant statistics, accumulated over batches of events
+# (per-case state is carried across batches, so cases may continue in a later batch)
+# (events of a case are expected in timestamp order across batches)
+# (e.g., keep a state on disk & absorb each day's new events, incl. those of known cases)
+
+class DfgState:
+
+    def __init__(self):
+        self.dfg = Counter()          # (src, tgt) -> count
+        self.perf_sum = Counter()     # (src, tgt) -> total seconds
+        self.activ_count = Counter()
+        self.start_activs = Counter()
+        self.end_activs = Counter()
+        self.variants = Counter()
+        self.num_cases = 0
+        # case -> (last activity, last timestamp, sequence so far)
+        # (in order of the cases' last events in the absorbed batches)
+        self.open_cases = {}
+        # cases that won't continue (see close_cases)
+        self.closed_cases = set()
+
+    def absorb(self, log):
+        # (ties keep their order in the batch, like pm4py's dfg discovery)
+        log = log.reset_index(drop=True).sort_values(by=[ 'case:concept:name', 'time:timestamp' ], kind='stable')
+        batch_pos = log.index.to_numpy()
+        cases = log['case:concept:name'].to_numpy()
+        activs = log['concept:name'].to_numpy()
+        ts = log['time:timestamp'].to_numpy()
+        if len(cases) == 0:
+            return
+
+        firsts = np.flatnonzero(np.r_[True, cases[1:] != cases[:-1]])
+        ends = np.r_[firsts[1:], len(cases)]
+
+        # (checked up front, so the state is left as is)
+        reopened = [ case for case in cases[firsts] if case in self.closed_cases ]
+        if len(reopened) > 0:
+            raise ValueError(f"case {reopened[0]}: new events for a closed case ({len(reopened)} closed cases reappear); "
+                             "close fewer cases (e.g., a larger max_idle or max_open in stream_dfg_state)")
+
+        # - directly-follows within this batch
+        inner = np.flatnonzero(np.r_[False, cases[1:] == cases[:-1]])
+        edges = pd.DataFrame({ 'src': activs[inner - 1], 'tgt': activs[inner],
+                               'diff': (ts[inner] - ts[inner - 1]) / np.timedelta64(1, 's') })
+        edges = edges.groupby([ 'src', 'tgt' ])['diff'].agg([ 'size', 'sum' ])
+        self.dfg.update(edges['size'].to_dict())
+        self.perf_sum.update(edges['sum'].to_dict())
+        self.activ_count.update(pd.Series(activs).value_counts().to_dict())
+
+        # - per case; connect with earlier batches (if any)
+        for start, end in zip(firsts, ends):
+            case = cases[start]
+            seq = tuple(activs[start:end])
+
+            if case in self.open_cases:
+                last_activ, last_ts, prior_seq = self.open_cases[case]
+                if ts[start] < last_ts:
+                    raise ValueError(f"case {case}: new events precede events of an earlier batch")
+                edge = (last_activ, seq[0])
+                self.dfg[edge] += 1
+                self.perf_sum[edge] += (ts[start] - last_ts) / np.timedelta64(1, 's')
+                # case's end & variant will change
+                decr(self.end_activs, prior_seq[-1])
+                decr(self.variants, prior_seq)
+                seq = prior_seq + seq
+            else:
+                self.start_activs[seq[0]] += 1
+                self.num_cases += 1
+
+            self.end_activs[seq[-1]] += 1
+            self.variants[seq] += 1
+            self.open_cases[case] = (seq[-1], ts[end - 1], seq)
+
+        # (re-insert in order of their last event in the batch)
+        for first in firsts[np.argsort(np.maximum.reduceat(batch_pos, firsts), kind='stable')]:
+            self.open_cases[cases[first]] = self.open_cases.pop(cases[first])
+
+    # forget per-case state of cases that won't continue
+    # (keeps memory bounded when streaming a log that is grouped by case)
+    # (only their ids are kept; absorbing new events for them raises a ValueError)
+    def close_cases(self, keep=()):
+        keep = { case: self.open_cases[case] for case in keep if case in self.open_cases }
+        self.closed_cases.update(case for case in self.open_cases if case not in keep)
+        self.open_cases = keep
+
+    # close the cases without events since before (a timestamp), and/or all but the max_open most recently seen ones
+    def close_inactive(self, before=None, max_open=None):
+        keep = self.open_cases
+        if before is not None:
+            before = np.datetime64(before)
+            keep = { case: state for case, state in keep.items() if state[1] >= before }
+        if max_open is not None and len(keep) > max_open:
+            keep = dict(list(keep.items())[len(keep) - max_open:])
+        self.close_cases(keep=keep)
+
+    def get_dfg(self, ann=ProcAnn.FREQ):
+        match ann:
+            case ProcAnn.FREQ:
+                return dict(self.dfg)
+            case ProcAnn.FREQ_PERC:
+                return { key: round((count / self.num_cases), 2) for key, count in self.dfg.items() }
+            case ProcAnn.PERF:
+                return { key: self.perf_sum[key] / count for key, count in self.dfg.items() }
+
+    def get_activ_count(self, ann=ProcAnn.FREQ):
+        if ann == ProcAnn.FREQ_PERC:
+            return { key: round((count / self.num_cases), 2) for key, count in self.activ_count.items() }
+        return dict(self.activ_count)
+
+    # (same as variant_stats.get_variants_stats, without rescanning the log)
+    def get_variants_stats(self, plot=True, collapse_activseq=None):
+        return variants_to_stats(self.variants, self.num_cases, plot, collapse_activseq)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    # returns names of statistics that differ from other state
+    # (performance sums are compared with a tolerance)
+    def diff(self, other, tol=1e-6):
+        diffs = [ name for name in [ 'dfg', 'activ_count', 'start_activs', 'end_activs', 'variants', 'num_cases' ]
+                 if getattr(self, name) != getattr(other, name) ]
+        if set(self.perf_sum) != set(other.perf_sum) or \
+                any(abs(total - other.perf_sum[key]) > tol * max(1.0, abs(total)) for key, total in self.perf_sum.items()):
+            diffs.append('perf_sum')
+        return diffs
+
+
+def decr(counter, key):
+    counter[key] -= 1
+    if counter[key] == 0:
+        del counter[key]
+
+
+# check whether incrementally maintained state equals a full recompute over log
+def check_incremental(state, log, verbose=True):
+    full = DfgState()
+    full.absorb(log)
+    diffs = state.diff(full)
+    if verbose and len(diffs) > 0:
+        print("differs from full recompute:", ", ".join(diffs))
+    return len(diffs) == 0
+
+
+# read csv in chunks, in any order in which each case's events come in timestamp order
+# (e.g., an export sorted on timestamp, or one grouped by case)
+# cases stay open across chunks (i.e., their sequence so far is kept), so memory grows with the # open cases;
+# to bound it, close cases after each chunk:
+# - max_idle: cases without events in the last max_idle seconds (as of the chunk's latest timestamp)
+# - max_open: all but the max_open cases seen last in the csv
+# (a closed case that reappears raises a ValueError; e.g., for a csv grouped by case, max_open=1 suffices)
+def stream_dfg_state(path, chunksize=1_000_000, state=None, max_idle=None, max_open=None):
+    state = DfgState() if state is None else state
+    columns = [ 'case:concept:name', 'concept:name', 'time:timestamp' ]
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunksize):
+        chunk['time:timestamp'] = pd.to_datetime(chunk['time:timestamp'])
+        state.absorb(chunk)
+        if max_idle is not None or max_open is not None:
+            before = chunk['time:timestamp'].max() - pd.Timedelta(seconds=max_idle) if max_idle is not None else None
+            state.close_inactive(before, max_open)
+    return state
+
+
+# same output as mine_dfg, but from accumulated statistics instead of a log
+# (like mine_dfg: view=False neither saves nor shows the graph; returns the gviz)
+def mine_dfg_state(state, ann=ProcAnn.FREQ, output_path=None, save_gviz=False, view=True):
+    match ann:
+        case ProcAnn.FREQ | ProcAnn.FREQ_PERC:
+            vis_var = dfg_visualizer.Variants.FREQUENCY
+        case ProcAnn.PERF:
+            vis_var = dfg_visualizer.Variants.PERFORMANCE
+
+    # (mine_dfg's log only provides activity counts & (zero) service times)
+    serv_time = { activ: 0.0 for activ in state.activ_count }
+    gviz = dfg_visualizer.apply(state.get_dfg(ann), variant=vis_var, activities_count=state.get_activ_count(ann), serv_time=serv_time)
+    return mine_vis(dfg_visualizer, gviz, output_path, save_gviz, view)
@@ -0,0 +1,172 @@
+import pandas as pd
+import os, sys, json, time, threading, tracemalloc, functools, itertools, inspect
+from contextlib import contextmanager
+
+# lightweight instrumentation: timed spans & progress callbacks
+#
+# - spans: per call of an instrumented function (see instrument) or block (see span),
+#   as dict: name, id, parent, start (epoch s), wall (s), rows_in, rows_out, peak_mb (if trace_memory), error, + attrs
+#   - sinks receive each finished span; without sinks, instrumented functions are called as-is
+#   - peak_mb: peak traced memory (MiB) above the span's start; only with trace_memory (tracemalloc slows things down)
+#   - (process workers inherit sinks when forked; JsonLinesSink appends, so these can share a file)
+#
+# - progress: report(message, done, total) goes to the progress callback
+#   (prints the message by default; set_progress(None) or with progress_to(None) silences, e.g., in batch runs)
+
+sinks = []
+trace_memory = False
+
+_local = threading.local()
+_ids = itertools.count()
+
+
+def add_sink(sink):
+    sinks.append(sink)
+    return sink
+
+def remove_sink(sink):
+    sinks.remove(sink)
+
+def clear_sinks():
+    sinks.clear()
+
+def set_trace_memory(enabled=True):
+    global trace_memory
+    trace_memory = enabled
+
+
+# - sinks
+# (any callable taking a span dict)
+
+# one json object per line
+class JsonLinesSink:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span, default=str) + "\n"
+        with self.lock, open(self.path, "a") as f:
+            f.write(line)
+
+# keeps spans in memory (e.g., to turn them into a dataframe; see to_frame)
+class ListSink:
+
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, span):
+        self.spans.append(span)
+
+    def to_frame(self):
+        return pd.DataFrame(self.spans)
+
+def stderr_sink(span):
+    print(json.dumps(span, default=str), file=sys.stderr)
+
+
+# - spans
+
+# (the span dict can be updated inside the block; e.g., span['rows_out'] = len(result))
+@contextmanager
+def span(name, rows_in=None, **attrs):
+    stack = _stack()
+    record = { 'name': name, 'id': next(_ids), 'parent': stack[-1]['record']['id'] if len(stack) > 0 else None,
+               'pid': os.getpid(), 'start': time.time(), 'wall': None, 'rows_in': rows_in, 'rows_out': None, **attrs }
+    frame = { 'record': record, 'own_tracing': False, 'mem_start': 0, 'max_peak': 0 }
+
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            frame['own_tracing'] = True
+        cur, peak = tracemalloc.get_traced_memory()
+        # (keep the parent's peak so far; peaks are reset per span)
+        if len(stack) > 0:
+            stack[-1]['max_peak'] = max(stack[-1]['max_peak'], peak)
+        tracemalloc.reset_peak()
+        frame['mem_start'] = cur
+
+    stack.append(frame)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        record['wall'] = time.perf_counter() - start
+        stack.pop()
+        if trace_memory and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], frame['max_peak'])
+            record['peak_mb'] = (peak - frame['mem_start']) / 2**20
+            if len(stack) > 0:
+                stack[-1]['max_peak'] = max(stack[-1]['max_peak'], peak)
+            if frame['own_tracing']:
+                tracemalloc.stop()
+        emit(record)
+
+
+def emit(record):
+    for sink in list(sinks):
+        sink(record)
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+# decorator: a span per call, with the rows of the log argument & result
+def instrument(fn):
+    name = f"{fn.__module__}.{fn.__qualname__}"
+    # (the 'log' parameter; otherwise, the first)
+    params = list(inspect.signature(fn).parameters)
+    log_pos = params.index('log') if 'log' in params else 0
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if len(sinks) == 0:
+            return fn(*args, **kwargs)
+        log = kwargs['log'] if 'log' in kwargs else (args[log_pos] if len(args) > log_pos else None)
+        with span(name, rows_in=num_rows(log)) as record:
+            result = fn(*args, **kwargs)
+            record['rows_out'] = num_rows(result[0] if isinstance(result, tuple) and len(result) > 0 else result)
+            return result
+
+    return wrapper
+
+
+# rows of a dataframe, series or TraceIndex (otherwise None)
+def num_rows(obj):
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if hasattr(obj, 'num_rows'):
+        return int(obj.num_rows)
+    return None
+
+
+# - progress
+
+def print_progress(message, done=None, total=None):
+    print(message)
+
+progress_callback = print_progress
+
+def set_progress(callback):
+    global progress_callback
+    progress_callback = callback
+
+@contextmanager
+def progress_to(callback):
+    prior = progress_callback
+    set_progress(callback)
+    try:
+        yield
+    finally:
+        set_progress(prior)
+
+def report(message, done=None, total=None):
+    if progress_callback is not None:
+        progress_callback(message, done, total)
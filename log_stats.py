@@ -1,54 +1,109 @@
+import pandas as pd
+import numpy as np
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from mine_cache import log_fingerprint
+from instrument import instrument
+
 # generic stats
 
+@instrument
 def get_att_presence(col, log):
     print('total:', len(log[col]))
     print('unique:', len(log[col].unique()))
     print('na:', len(log[log[col].isna()]))
     print('not na:', len(log[log[col].notna()]))
     
+@instrument
 def get_relation_details(col1, col2, log, verbose=False):
     dir1 = get_dir_relation_details(col1, col2, log, verbose)
     dir2 = get_dir_relation_details(col2, col1, log, verbose)
     print(f"{dir1}-{dir2}")
 
+@instrument
 def get_dir_relation_details(col_from, col_to, log, verbose=False):
-    groups = log.groupby(col_from)[col_to].unique()
-    nums = groups.apply(len)
-    num_many = len(nums[nums > 1])
+    codes_from, uniq_from = pd.factorize(log[col_from])
+    codes_to, _ = pd.factorize(log[col_to])
+    num_many = count_many(codes_from, len(uniq_from), codes_to)
     if verbose:
         num_total = len(log[col_from].unique())
         print(f"{num_many} (out of {num_total}) {col_from} with many {col_to}")
-    return 'many' if len(nums[nums > 1]) > 1 else 'one'
+    return 'many' if num_many > 1 else 'one'
+
+
+# one/many relation for all pairs of columns (row: from, column: to)
+# (same rule as get_dir_relation_details: 'many' if more than one from-value has many to-values)
+# - workers: # threads, each handling from-columns
+# - early_exit: stop scanning a pair once it's 'many' (scans chunks of chunksize rows)
+@instrument
+def get_relation_matrix(log, columns=None, workers=None, early_exit=True, chunksize=100_000):
+    columns = list(log.columns) if columns is None else columns
+    # (factorize each column once)
+    codes = { col: pd.factorize(log[col]) for col in columns }
+
+    def relations_from(col_from):
+        codes_from, uniq_from = codes[col_from]
+        return { col_to: count_many(codes_from, len(uniq_from), codes[col_to][0], 
+                                    limit=2 if early_exit else None, chunksize=chunksize) > 1
+                 for col_to in columns if col_to != col_from }
+
+    if workers is None:
+        relations = [ relations_from(col) for col in columns ]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            relations = list(pool.map(relations_from, columns))
+
+    matrix = pd.DataFrame('', index=pd.Index(columns, name='from'), columns=pd.Index(columns, name='to'))
+    for col_from, rels in zip(columns, relations):
+        for col_to, many in rels.items():
+            matrix.loc[col_from, col_to] = 'many' if many else 'one'
+    return matrix
+
+
+# number of from-values (codes) with more than one to-value
+# (one pass: remember the first to-value per from-value, mark those that differ later on)
+# (missing from-values are skipped; missing to-values count as a value, like unique())
+# - limit: stop once this many are found (checked per chunk)
+def count_many(codes_from, num_from, codes_to, limit=None, chunksize=100_000):
+    first_to = np.full(num_from, -2, dtype=np.int64)
+    many = np.zeros(num_from, dtype=bool)
+    step = len(codes_from) if limit is None else chunksize
+    for start in range(0, len(codes_from), max(step, 1)):
+        cur_from, cur_to = codes_from[start:start + step], codes_to[start:start + step]
+        present = cur_from >= 0
+        cur_from, cur_to = cur_from[present], cur_to[present]
+        unseen = first_to[cur_from] == -2
+        first_to[cur_from[unseen]] = cur_to[unseen]
+        many[cur_from[first_to[cur_from] != cur_to]] = True
+        if limit is not None and many.sum() >= limit:
+            break
+    return int(many.sum())
 
 
 # stats for events
+# (all via the log's profile; see LogProfile)
 
 # count total number of occurrences of events (absolute & percentage)
+@instrument
 def count_events(evt_col, case_col, log, plot=True):
-    total_evts = len(log[evt_col])
-    evt_counts = log.groupby(evt_col)[case_col].count().rename('cnt').to_frame()
-    evt_counts['perc'] = 100 / total_evts * evt_counts['cnt']
-    evt_counts = evt_counts.sort_values(by='perc', ascending=False)
-    # for idx, row in evt_counts.items():
-    #     print(idx, row[0], row[1])
+    evt_counts = get_profile(log, evt_col, case_col).event_counts()
     if plot:
         ax = evt_counts[['perc']].plot.bar()
         ax.xaxis.set_visible(False)
     return evt_counts
 
 # per event, count number of cases that it occurs in (absolute & percentage)
+@instrument
 def count_cases_per_event(evt_col, case_col, log, plot=True):
-    total_cases = len(log[case_col].unique())
-    evts_cases = log.groupby(evt_col)[case_col].unique().rename('cases').to_frame()
-    evts_cases['cases'] = evts_cases['cases'].apply(len)
-    evts_cases['perc'] = 100 / total_cases * evts_cases['cases']
-    evt_cases = evts_cases.sort_values(by='perc', ascending=False)
+    evt_cases = get_profile(log, evt_col, case_col).cases_per_event()
     if plot:
         ax = evt_cases[['perc']].plot.bar()
         ax.xaxis.set_visible(False)
     return evt_cases
 
 # filter log
+@instrument
 def filter_events_on_counts(evt_col, leq_perc, counts, log):
     keep_evts = counts[counts['perc']>leq_perc].index.array
     return log[log[evt_col].isin(keep_evts)]
@@ -56,12 +111,194 @@ def filter_events_on_counts(evt_col, leq_perc, counts, log):
 
 # stats for traces
 
+@instrument
 def get_trace_lengths(evt_col, case_col, log, plot=True):
-    trace_lens = log.groupby(case_col)[evt_col].count()
-    trace_lens = trace_lens.sort_values(ascending=False)
-    # for idx, cnt in trace_lens.items():
-    #     print(idx, cnt)
+    trace_lens = get_profile(log, evt_col, case_col).trace_lengths()
     if plot:
         ax = trace_lens.plot.bar()
         ax.xaxis.set_visible(False)
-    return trace_lens
\ No newline at end of file
+    return trace_lens
+
+
+# log profile
+# (event counts, cases per event, trace lengths, start/end activities & null rates, from one pass over the log)
+# - approx=False: exact; groups on factorized case & event codes
+# - approx=True: for logs too large to group exactly; works on hashes of the case ids, in chunks
+#   (never factorizes or copies whole columns; memory is bounded by chunksize & the sketches)
+#   - cases per event & # cases: HyperLogLog (relative error ca. 1.04 / sqrt(2^hll_p))
+#   - trace lengths: Count-Min sketch (only per case; see trace_length)
+#   - no start/end activities (these need the cases' orderings)
+
+MAX_PROFILES = 8
+
+class LogProfile:
+
+    def __init__(self, log, evt_col='concept:name', case_col='case:concept:name', approx=False,
+                 hll_p=12, cms_width=1 << 20, cms_depth=4, chunksize=1_000_000):
+        self.evt_col = evt_col
+        self.case_col = case_col
+        self.approx = approx
+        self.num_events = len(log)
+
+        if approx:
+            self.sketch(log, hll_p, cms_width, cms_depth, chunksize)
+            self.lengths = self.start_counts = self.end_counts = None
+        else:
+            self.null_rates = log.isna().mean()
+            evt_codes, self.activities = pd.factorize(log[evt_col], sort=True)
+            valid = evt_codes >= 0
+            # (like groupby.count: only events with a case)
+            self.evt_counts = np.bincount(evt_codes[valid & log[case_col].notna().to_numpy()], minlength=len(self.activities))
+
+            case_codes, self.case_ids = pd.factorize(log[case_col])
+            self.num_cases = len(self.case_ids)
+            self.lengths = np.bincount(case_codes[case_codes >= 0], minlength=self.num_cases)
+
+            # distinct (event, case) pairs
+            with_case = valid & (case_codes >= 0)
+            pairs = pd.unique(evt_codes[with_case].astype(np.int64) * max(self.num_cases, 1) + case_codes[with_case])
+            self.case_counts = np.bincount(pairs // max(self.num_cases, 1), minlength=len(self.activities))
+
+            # start & end events: first & last per case in timestamp order (if any)
+            # (ties in log order; written in reverse for the firsts, so the earliest is written last)
+            rows = np.argsort(log['time:timestamp'].to_numpy(), kind='stable') if 'time:timestamp' in log.columns else np.arange(len(log))
+            rows = rows[case_codes[rows] >= 0]
+            firsts = np.zeros(self.num_cases, dtype=np.int64)
+            firsts[case_codes[rows[::-1]]] = rows[::-1]
+            lasts = np.zeros(self.num_cases, dtype=np.int64)
+            lasts[case_codes[rows]] = rows
+            self.start_counts = self.count_activs(evt_codes[firsts])
+            self.end_counts = self.count_activs(evt_codes[lasts])
+
+    # approx: one pass over chunks of the raw column values (incl. null counts)
+    # (no factorizing of whole columns; activities get codes as they appear, sorted at the end)
+    def sketch(self, log, hll_p, cms_width, cms_depth, chunksize):
+        self.hll_p = hll_p
+        self.cms = np.zeros((cms_depth, cms_width), dtype=np.int64)
+        null_counts = pd.Series(0, index=log.columns, dtype=np.int64)
+        # activity -> row in registers & evt_counts (row 0: all cases)
+        activ_rows = {}
+        registers = np.zeros((1, 1 << hll_p), dtype=np.uint8)
+        evt_counts = np.zeros(1, dtype=np.int64)
+
+        for start in range(0, len(log), chunksize):
+            chunk = log.iloc[start:start + chunksize]
+            null_counts += chunk.isna().sum()
+            with_case = chunk[self.case_col].notna().to_numpy()
+            codes, uniques = pd.factorize(chunk[self.evt_col])
+            new = [ activ for activ in uniques if activ not in activ_rows ]
+            if len(new) > 0:
+                activ_rows.update({ activ: len(activ_rows) + 1 + i for i, activ in enumerate(new) })
+                registers = np.vstack([ registers, np.zeros((len(new), registers.shape[1]), dtype=np.uint8) ])
+                evt_counts = np.r_[evt_counts, np.zeros(len(new), dtype=np.int64)]
+            # (missing activities (code -1) go to row 0)
+            rows = np.r_[np.fromiter((activ_rows[activ] for activ in uniques), dtype=np.int64, count=len(uniques)), 0][codes][with_case]
+
+            hashes = pd.util.hash_array(chunk[self.case_col].to_numpy()[with_case])
+            hll_add(registers, rows, hashes, hll_p)
+            hll_add(registers, np.zeros(len(hashes), dtype=np.int64), hashes, hll_p)
+            for row, idx in enumerate(cms_indexes(hashes, cms_depth, cms_width)):
+                self.cms[row] += np.bincount(idx, minlength=cms_width)
+            evt_counts += np.bincount(rows, minlength=len(evt_counts))
+
+        activities = np.array(list(activ_rows), dtype=object)
+        order = np.argsort(activities, kind='stable')
+        estimates = hll_estimate(registers)
+        self.activities = pd.Index(activities[order])
+        self.evt_counts = evt_counts[1:][order]
+        self.case_counts, self.num_cases = estimates[1:][order], estimates[0]
+        self.null_rates = null_counts / len(log) if len(log) > 0 else log.isna().mean()
+
+    def count_activs(self, codes):
+        counts = pd.Series(np.bincount(codes[codes >= 0], minlength=len(self.activities)), index=self.activities)
+        return counts[counts > 0].sort_values(ascending=False)
+
+    # (same layouts as the former groupby-based functions)
+
+    def event_counts(self):
+        evt_counts = pd.DataFrame({ 'cnt': self.evt_counts }, index=pd.Index(self.activities, name=self.evt_col))
+        evt_counts['perc'] = 100 / self.num_events * evt_counts['cnt']
+        return evt_counts.sort_values(by='perc', ascending=False)
+
+    def cases_per_event(self):
+        evt_cases = pd.DataFrame({ 'cases': self.case_counts }, index=pd.Index(self.activities, name=self.evt_col))
+        evt_cases['perc'] = 100 / self.num_cases * evt_cases['cases']
+        return evt_cases.sort_values(by='perc', ascending=False)
+
+    def trace_lengths(self):
+        if self.approx:
+            raise ValueError("no trace lengths per case in approx mode; use trace_length(case)")
+        trace_lens = pd.Series(self.lengths, index=pd.Index(self.case_ids, name=self.case_col), name=self.evt_col)
+        return trace_lens.sort_values(ascending=False)
+
+    def trace_length(self, case):
+        if not self.approx:
+            return int(self.lengths[self.case_ids.get_loc(case)])
+        hashes = pd.util.hash_array(np.array([ case ], dtype=object if isinstance(case, str) else None))
+        return int(min(self.cms[row, idx[0]] for row, idx in enumerate(cms_indexes(hashes, *self.cms.shape))))
+
+    def start_activities(self):
+        return self.start_counts
+
+    def end_activities(self):
+        return self.end_counts
+
+
+# profile of the log, from a cache of the MAX_PROFILES most recently used ones
+# (keyed on profile_fingerprint; so, logs with the same contents share a profile)
+# (not kept on the log itself: log.attrs ends up in the metadata of to_parquet & co)
+@instrument
+def get_profile(log, evt_col='concept:name', case_col='case:concept:name', approx=False):
+    key = (profile_fingerprint(log, [ case_col, evt_col, 'time:timestamp' ]), evt_col, case_col, approx)
+    if key in profiles:
+        profiles.move_to_end(key)
+    else:
+        profiles[key] = LogProfile(log, evt_col, case_col, approx)
+        while len(profiles) > MAX_PROFILES:
+            profiles.popitem(last=False)
+    return profiles[key]
+
+profiles = OrderedDict()
+
+def clear_profiles():
+    profiles.clear()
+
+
+# fingerprint of all values the profile depends on: the key columns (see mine_cache.log_fingerprint),
+# columns & dtypes, and the null counts of the other columns
+def profile_fingerprint(log, columns):
+    others = [ col for col in log.columns if col not in columns ]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(log_fingerprint(log, columns).encode())
+    h.update(repr((len(log), list(log.columns), [ str(dtype) for dtype in log.dtypes ])).encode())
+    h.update(log[others].isna().sum().to_numpy().tobytes())
+    return h.hexdigest()
+
+
+# - sketches
+
+def hll_add(registers, groups, hashes, p):
+    buckets = (hashes >> np.uint64(64 - p)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - p)) - 1)
+    # position of the leftmost 1-bit in the remaining 64 - p bits
+    rank = np.full(len(hashes), 64 - p + 1, dtype=np.uint8)
+    nonzero = rest > 0
+    rank[nonzero] = (64 - p) - np.floor(np.log2(rest[nonzero].astype(np.float64))).astype(np.uint8)
+    np.maximum.at(registers, (groups, buckets), rank)
+
+def hll_estimate(registers):
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=1)
+    # (small range correction: linear counting)
+    zeros = np.sum(registers == 0, axis=1)
+    small = (raw <= 2.5 * m) & (zeros > 0)
+    raw[small] = m * np.log(m / zeros[small])
+    raw[zeros == m] = 0
+    return np.round(raw).astype(np.int64)
+
+# per row of the sketch, a counter index for each hash
+# (double hashing on the two 32-bit halves)
+def cms_indexes(hashes, depth, width):
+    lo, hi = hashes & np.uint64(0xFFFFFFFF), hashes >> np.uint64(32)
+    return [ ((lo + np.uint64(row) * hi) % np.uint64(width)).astype(np.int64) for row in range(depth) ]
@@ -0,0 +1,77 @@
+import pandas as pd
+import os, hashlib, pickle
+
+# disk-backed memoization of discovery results (nets, trees, dfgs)
+# (keyed on log fingerprint, miner name & parameters; size-bounded, evicts least recently used)
+
+class MineCache:
+
+    def __init__(self, path=".mine_cache", max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def get_or_compute(self, miner, log, params, compute_fn):
+        if not self.enabled:
+            return compute_fn()
+
+        path = os.path.join(self.path, cache_key(miner, log, params) + ".pkl")
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    result = pickle.load(f)
+                os.utime(path) # (mark as recently used)
+                self.hits += 1
+                return result
+            except (EOFError, pickle.UnpicklingError):
+                pass # (e.g., partially written; recompute)
+
+        self.misses += 1
+        result = compute_fn()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f)
+        os.replace(tmp_path, path)
+        self.evict()
+        return result
+
+    # drop least recently used entries until under max_bytes
+    def evict(self):
+        entries = [ entry for entry in os.scandir(self.path) if entry.name.endswith(".pkl") ]
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        total = 0
+        for entry in entries:
+            total += entry.stat().st_size
+            if total > self.max_bytes:
+                os.remove(entry.path)
+
+    def invalidate(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".pkl"):
+                os.remove(entry.path)
+
+    def stats(self):
+        entries = [ entry for entry in os.scandir(self.path) if entry.name.endswith(".pkl") ]
+        return { 'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                 'bytes': sum(entry.stat().st_size for entry in entries) }
+
+
+# fast fingerprint of a log's case, activity & timestamp columns
+# (hashes the columns' values; not their order in memory)
+def log_fingerprint(log, columns=[ 'case:concept:name', 'concept:name', 'time:timestamp' ]):
+    columns = [ col for col in columns if col in log.columns ]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(columns).encode())
+    h.update(pd.util.hash_pandas_object(log[columns], index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def cache_key(miner, log, params):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(miner.encode())
+    h.update(repr(sorted(params.items())).encode())
+    h.update(log_fingerprint(log).encode())
+    return h.hexdigest()
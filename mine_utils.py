@@ -13,37 +13,150 @@ from pm4py.objects.conversion.process_tree import converter as process_tree_conv
 from pm4py.visualization.heuristics_net.variants.pydotplus_vis import get_graph as hn_get_graph
 from pm4py.statistics.attributes.log import get as attr_get
 import pandas as pd
+import numpy as np
+import os, hashlib, json
+from trace_index import TraceIndex
+from dfg_lod import get_lod_dfgs, level_stats
+from compact_log import compact_log, column_codes, lookup_codes, replace_at, sort_events
+from mine_cache import MineCache
+import log_stats
+from log_stats import get_profile
+from instrument import instrument, report
+
+# (optional; without pyarrow, get_log simply re-parses the csv every time)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+CACHE_SUFFIX = ".cache.parquet"
+CACHE_META_KEY = b'ircc:source'
+
+# (compact: see compact_log.py)
+@instrument
+def get_log(path, columns=None, cache=True, compact=False):
+    if not cache or pa is None:
+        log = read_log_csv(path, columns)
+        return compact_log(log) if compact else log
+
+    cache_path = path + CACHE_SUFFIX
+    source = get_source_key(path)
+    cached = read_cache_key(cache_path)
+
+    if cached is None or cached['size'] != source['size']:
+        write_log_cache(read_log_csv(path), cache_path, source)
+    elif cached['mtime_ns'] != source['mtime_ns']:
+        # (e.g., touched after a copy or checkout; content hash decides)
+        source['hash'] = hash_file(path)
+        if cached['hash'] == source['hash']:
+            # only refresh the key, so we don't re-hash on every call
+            write_log_cache(read_log_cache(cache_path), cache_path, source)
+        else:
+            write_log_cache(read_log_csv(path), cache_path, source)
+
+    return read_log_cache(cache_path, columns, compact)
 
-def get_log(path):
-    log = pd.read_csv(path, index_col=False)
-    log['time:timestamp'] = pd.to_datetime(log['time:timestamp'])
+
+def read_log_csv(path, columns=None):
+    log = pd.read_csv(path, index_col=False, usecols=columns)
+    if 'time:timestamp' in log.columns:
+        log['time:timestamp'] = pd.to_datetime(log['time:timestamp'])
     return log
 
+
+# cache is keyed on the source file's size, mtime & content hash
+# (content hash is only computed when size matches but mtime doesn't)
+
+def get_source_key(path):
+    stat = os.stat(path)
+    return { 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns }
+
+
+def hash_file(path, block_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_cache_key(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    meta = pq.read_schema(cache_path).metadata or {}
+    if CACHE_META_KEY not in meta:
+        return None
+    return json.loads(meta[CACHE_META_KEY])
+
+
+def write_log_cache(log, cache_path, source):
+    if 'hash' not in source:
+        source = { **source, 'hash': hash_file(cache_path[:-len(CACHE_SUFFIX)]) }
+
+    # case & activity columns as categoricals (stored as dictionaries)
+    # (timestamps are already native datetime64 after read_log_csv)
+    log = log.astype({ col: 'category' for col in [ 'case:concept:name', 'concept:name' ] if col in log.columns })
+    table = pa.Table.from_pandas(log, preserve_index=False)
+    table = table.replace_schema_metadata({ **(table.schema.metadata or {}), CACHE_META_KEY: json.dumps(source) })
+
+    # write to tmp file first; avoids half-written caches
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp" # (unique; workers may load the same log)
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def read_log_cache(cache_path, columns=None, compact=False):
+    log = pq.read_table(cache_path, columns=columns).to_pandas()
+    # restore the original dtypes (e.g., int case ids)
+    # (observed=False groupbys on categoricals would yield empty groups downstream)
+    # (compact logs keep the string categories)
+    for col in [ 'case:concept:name', 'concept:name' ]:
+        if col in log.columns and isinstance(log[col].dtype, pd.CategoricalDtype):
+            if not compact or pd.api.types.is_numeric_dtype(log[col].cat.categories.dtype):
+                log[col] = log[col].astype(log[col].cat.categories.dtype)
+    return compact_log(log) if compact else log
+
+
 class ProcAnn(Enum):
     FREQ = "frequency"
     FREQ_PERC = "frequency (percentage)"
     PERF = "performance"
 
-def mine_vis(visualizer, gviz, output_path, save_gviz=False):
+# (optional) disk cache for discovery results; see enable_mine_cache
+mine_cache = None
+
+def enable_mine_cache(path=".mine_cache", max_bytes=1 << 30):
+    global mine_cache
+    mine_cache = MineCache(path, max_bytes)
+    return mine_cache
+
+def disable_mine_cache():
+    global mine_cache
+    mine_cache = None
+
+@instrument
+def discover(miner, log, params, discover_fn):
+    if mine_cache is None:
+        return discover_fn()
+    return mine_cache.get_or_compute(miner, log, params, discover_fn)
+
+
+# (mine_* return the gviz; view=False only returns it, e.g., for its .source)
+@instrument
+def mine_vis(visualizer, gviz, output_path, save_gviz=False, view=True):
     if output_path is not None:
         visualizer.save(gviz, f"{output_path}.jpg")
         if save_gviz:
             gviz.save(f"{output_path}.gv")
-    else:
+    elif view:
         visualizer.view(gviz)
+    return gviz
 
-def mine_dfg(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False):
-    match ann:
-        case ProcAnn.FREQ | ProcAnn.FREQ_PERC:
-            mine_var = dfg_discovery.Variants.FREQUENCY
-            vis_var = dfg_visualizer.Variants.FREQUENCY
-        case ProcAnn.PERF:
-            mine_var = dfg_discovery.Variants.PERFORMANCE
-            vis_var = dfg_visualizer.Variants.PERFORMANCE
-    
-    # discover
-    parameters = { 'pm4py:param:start_timestamp_key': 'time:timestamp' }
-    dfg = dfg_discovery.apply(log, variant=mine_var, parameters = parameters)
+@instrument
+def mine_dfg(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False, view=True):
+    vis_var = dfg_vis_variant(ann)
+    dfg = discover_dfg(log, perf=ann == ProcAnn.PERF)
 
     activ_count = None
     if ann == ProcAnn.FREQ_PERC:
@@ -55,21 +168,81 @@ def mine_dfg(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False):
 
     # visualize
     gviz = dfg_visualizer.apply(dfg, log=log, variant=vis_var, activities_count=activ_count)
-    mine_vis(dfg_visualizer, gviz, output_path, save_gviz)
-        
+    return mine_vis(dfg_visualizer, gviz, output_path, save_gviz, view)
+
+
+# (performance: mean time between directly-following events, from the temporal features)
+def discover_dfg(log, perf=False):
+    if perf:
+        discover_fn = lambda: get_perf_dfg(log)
+    else:
+        parameters = { 'pm4py:param:start_timestamp_key': 'time:timestamp' }
+        discover_fn = lambda: dfg_discovery.apply(log, variant=dfg_discovery.Variants.FREQUENCY, parameters = parameters)
+    return discover('dfg', log, { 'perf': perf }, discover_fn)
 
-def mine_alpha(log, output_path=None, save_gviz=False):
+
+def dfg_vis_variant(ann):
+    match ann:
+        case ProcAnn.FREQ | ProcAnn.FREQ_PERC:
+            return dfg_visualizer.Variants.FREQUENCY
+        case ProcAnn.PERF:
+            return dfg_visualizer.Variants.PERFORMANCE
+
+
+# level-of-detail dfgs (see dfg_lod.py), pruned on frequency (also with ann=PERF)
+# - writes <output_path>.lod<coverage>.svg per coverage (& .gv, if save_gviz)
+# - returns per coverage: # activities, # edges & % of the flow shown
+@instrument
+def mine_dfg_lods(log, ann=ProcAnn.FREQ, output_path=None, coverages=(50, 80, 95), save_gviz=False, view=True):
+    if ann not in [ ProcAnn.FREQ, ProcAnn.PERF ]:
+        raise ValueError(f"Unsupported annotation: {ann}")
+    freq_dfg = discover_dfg(log)
+    if ann == ProcAnn.PERF:
+        ann_dfg = discover_dfg(log, perf=True)
+        # (pruned on the edges that have a performance value; e.g., not those of events without a timestamp)
+        edges = { edge: count for edge, count in freq_dfg.items() if edge in ann_dfg }
+    else:
+        ann_dfg = edges = freq_dfg
+
+    profile = get_profile(log)
+    starts, ends = profile.start_activities().to_dict(), profile.end_activities().to_dict()
+    activ_count = profile.event_counts()['cnt'].to_dict()
+
+    stats = {}
+    for coverage, level in get_lod_dfgs(edges, starts, ends, coverages).items():
+        activs = { activ for edge in level for activ in edge }
+        parameters = { 'format': 'svg', 'maxNoOfEdgesInDiagram': max(len(level), 1),
+                       'start_activities': { activ: count for activ, count in starts.items() if activ in activs },
+                       'end_activities': { activ: count for activ, count in ends.items() if activ in activs } }
+        # (like mine_dfg & mine_dfg_state: (zero) service times, as events only have a completion timestamp)
+        gviz = dfg_visualizer.apply({ edge: ann_dfg[edge] for edge in level }, variant=dfg_vis_variant(ann), parameters=parameters,
+                                    activities_count={ activ: activ_count[activ] for activ in activs },
+                                    serv_time={ activ: 0.0 for activ in activs })
+        if output_path is not None:
+            dfg_visualizer.save(gviz, f"{output_path}.lod{coverage}.svg")
+            if save_gviz:
+                gviz.save(f"{output_path}.lod{coverage}.gv")
+        elif view:
+            dfg_visualizer.view(gviz)
+        stats[coverage] = level_stats(freq_dfg, level)
+    return stats
+
+
+@instrument
+def mine_alpha(log, output_path=None, save_gviz=False, view=True):
     # alpha miner
-    net, initial_marking, final_marking = alpha_miner.apply(log)
+    net, initial_marking, final_marking = discover('alpha', log, {}, lambda: alpha_miner.apply(log))
 
     # visualise
     gviz = pn_visualizer.apply(net, initial_marking, final_marking)
-    mine_vis(pn_visualizer, gviz, output_path, save_gviz)
+    return mine_vis(pn_visualizer, gviz, output_path, save_gviz, view)
     
 
-def mine_heur(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False):
+@instrument
+def mine_heur(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False, view=True):
     # heuristics miner
-    heu_net = heuristics_miner.apply_heu(log, { "heu_net_decoration": ann.value })
+    heu_net = discover('heur', log, { 'ann': ann.value }, 
+                       lambda: heuristics_miner.apply_heu(log, { "heu_net_decoration": ann.value }))
 
     # visualize
     # (works differently ...)
@@ -78,13 +251,14 @@ def mine_heur(log, ann=ProcAnn.FREQ, output_path=None, save_gviz=False):
         gviz.write(f"{output_path}.gv")
     
     gviz = hn_visualizer.apply(heu_net)
-    mine_vis(hn_visualizer, gviz, output_path, False)
+    return mine_vis(hn_visualizer, gviz, output_path, False, view)
     
     
-def mine_induct(log, convert_to=None, ann=None, output_path=None, save_gviz=False):
+@instrument
+def mine_induct(log, convert_to=None, ann=None, output_path=None, save_gviz=False, view=True):
     # create the process tree
     # (wvw: drop "_tree" from call)
-    tree = inductive_miner.apply(log)
+    tree = discover('induct', log, {}, lambda: inductive_miner.apply(log))
 
     if convert_to is not None:
         match (convert_to):
@@ -104,21 +278,23 @@ def mine_induct(log, convert_to=None, ann=None, output_path=None, save_gviz=Fals
             case _:
                 raise f"Unsupported format: {convert_to}"
         
-        mine_vis(pn_visualizer, gviz, output_path, save_gviz)
+        return mine_vis(pn_visualizer, gviz, output_path, save_gviz, view)
     else:
         gviz = pt_visualizer.apply(tree)
-        mine_vis(pt_visualizer, gviz, output_path, save_gviz)
+        return mine_vis(pt_visualizer, gviz, output_path, save_gviz, view)
         
         
-def mine_ilp(log, output_path=None, save_gviz=False):
+@instrument
+def mine_ilp(log, output_path=None, save_gviz=False, view=True):
     # heuristics miner
-    net, init_mark, final_mark = ilp_miner.apply(log)
+    net, init_mark, final_mark = discover('ilp', log, {}, lambda: ilp_miner.apply(log))
 
     # visualize
     gviz = pn_visualizer.apply(net, init_mark, final_mark)
-    mine_vis(pn_visualizer, gviz, output_path, save_gviz)
+    return mine_vis(pn_visualizer, gviz, output_path, save_gviz, view)
     
     
+@instrument
 def log_subset_horizontal(log, perc):
     new_len = int(log.shape[0] * perc)
     new_log = log.iloc[0:new_len]
@@ -135,117 +311,172 @@ def log_subset_horizontal(log, perc):
     return new_log
 
 
-def log_subset_vertical(log, perc):
-    print("original:")
-    counts = log.groupby('case:concept:name')['concept:name'].count()
-    print(counts.describe())
+# keeps the first <perc> of each case's events
+# (in case, timestamp & activity order, as in TraceIndex; not in log row order, if these differ)
+# (index: optional TraceIndex of the log; otherwise, it's built here)
+# (see sampling.py for samples of whole cases)
+@instrument
+def log_subset_vertical(log, perc, index=None):
+    index = TraceIndex.from_log(log) if index is None else index
+    index.check_log(log)
+    report("original:\n" + pd.Series(index.lengths).describe().to_string())
     
-    case_logs = [ df for _, df in log.groupby('case:concept:name') ]
-    case_logs = map(lambda df: df.iloc[0:int(df.shape[0]*perc)], case_logs)
+    new_lengths = (index.lengths * perc).astype(int)
+    keep = index.positions() < np.repeat(new_lengths, index.lengths)
+    # (rows in that same order)
+    log_subset = log.iloc[index.rows[keep]]
     
-    log_subset = pd.concat(case_logs)
-    
-    print("\nsubset:")
-    counts = log_subset.groupby('case:concept:name')['concept:name'].count()
-    print(counts.describe())
+    report("\nsubset:\n" + pd.Series(new_lengths[new_lengths > 0]).describe().to_string())
     
     return log_subset
 
 
+# per-event & per-case temporal features, in one pass over the log sorted on case & timestamp
+# (in seconds; NaN where undefined, i.e., at case boundaries)
+# - time_since_prev: since the previous event of the case
+# - time_to_next: until the next event of the case
+# - case_elapsed: since the first event of the case
+# - case_duration: from first to last event of the case
+# (sort=False: log is already sorted, e.g., on case, timestamp & activity)
+@instrument
+def temporal_features(log, sort=True):
+    if sort:
+        # (ties keep their order in the log, like pm4py's dfg discovery)
+        log = sort_events(log, ['case:concept:name', 'time:timestamp'])
+    
+    ns = get_ns(log)
+    starts = get_case_starts(log)
+    ends = np.r_[starts[1:], True] if len(log) > 0 else starts
+    
+    diffs = np.diff(ns) / 1e9
+    time_since_prev = np.r_[np.nan, diffs]
+    time_since_prev[starts] = np.nan
+    time_to_next = np.r_[diffs, np.nan]
+    time_to_next[ends] = np.nan
+    
+    # first & last timestamp of each event's case
+    case_codes = np.cumsum(starts) - 1
+    firsts, lasts = ns[starts][case_codes], ns[ends][case_codes]
+    
+    return log.assign(time_since_prev=time_since_prev, time_to_next=time_to_next,
+                      case_elapsed=(ns - firsts) / 1e9, case_duration=(lasts - firsts) / 1e9)
+
+
+def get_ns(log):
+    return log['time:timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64)
+
+# (log is sorted on case)
+def get_case_starts(log):
+    cases = column_codes(log['case:concept:name'])
+    return np.r_[True, cases[1:] != cases[:-1]] if len(log) > 0 else np.zeros(0, dtype=bool)
+
+
+# mean time (seconds) until the case moves on, per activity
+# (i.e., sojourn time, when events only have a completion timestamp)
+@instrument
+def get_sojourn_times(log):
+    features = log if 'time_to_next' in log.columns else temporal_features(log)
+    return features.groupby('concept:name', observed=True)['time_to_next'].mean()
+
+
+# mean time (seconds) per directly-follows relation
+# (same as pm4py's performance dfg)
+@instrument
+def get_perf_dfg(log):
+    features = log if 'time_since_prev' in log.columns else temporal_features(log)
+    activs = features['concept:name'].to_numpy()
+    inner = np.flatnonzero(~np.isnan(features['time_since_prev'].to_numpy()))
+    edges = pd.DataFrame({ 'src': activs[inner - 1], 'tgt': activs[inner], 
+                           'diff': features['time_since_prev'].to_numpy()[inner] })
+    return edges.groupby([ 'src', 'tgt' ])['diff'].mean().to_dict()
+
+
+# adds time_diff (time since the previous event of the case; NaN for first events)
+# & index (position after sorting on case, timestamp & activity)
+@instrument
 def get_time_diff(log):
     log = log.drop([ 'index', 'time_diff' ], axis=1, errors='ignore') # drop any prior columns (if any)
-    log = log.sort_values(by=['case:concept:name', 'time:timestamp', 'concept:name'])
-    log = log.reset_index().drop('index', axis=1) # reset & forget current index
+    log = sort_events(log, ['case:concept:name', 'time:timestamp', 'concept:name'])
+    log = log.reset_index(drop=True) # forget current index
     log = log.reset_index() # get current index as column
     
-    cases_firsts = log.groupby('case:concept:name').first().reset_index()
-    cases_firsts
-    
-    log['time_diff'] = log['time:timestamp'] - log['time:timestamp'].shift(1)
-    log['time_diff'] = log['time_diff'].apply(pd.Timedelta.total_seconds)
-    log['time_diff']
+    # (only time_since_prev of temporal_features)
+    time_diff = np.r_[np.nan, np.diff(get_ns(log)) / 1e9] if len(log) > 0 else np.zeros(0)
+    time_diff[get_case_starts(log)] = np.nan
     
-    # irrelevant time differences for first events of cases
-    log.loc[cases_firsts['index'], 'time_diff'] = 1_000_000
-    # print(log[log['time_diff']==1_000_000].shape[0]) # sanity check
-    
-    return log
+    return log.assign(time_diff=time_diff)
 
 
-def equal_timestamps_interval(log, interval):
+# give events that are less than <interval> seconds apart the same timestamp (that of the "anchor" event)
+# - measure='chained': compare with the previous event (so, chains of close events can span > interval)
+# - measure='anchor': compare with the current anchor (i.e., buckets of at most <interval>)
+# (doesn't modify the given log)
+@instrument
+def equal_timestamps_interval(log, interval, measure='chained'):
     if 'time_diff' not in log.columns:
         log = get_time_diff(log)
     
-    # set time_diff2 to 0 if time_diff is less than <interval>
-    log['time_diff2'] = log['time_diff']
-    log.loc[log['time_diff2'] < interval, 'time_diff2'] = 0
-    
-    # get all rows where time difference was _not_ less than interval
-    intervals = log[log['time_diff2'] > 0][['index', 'time:timestamp']]
-    # these rows' timestamps will apply to all subsequent rows where time_diff2 == 0
-    # (so, until the next row in this df)
-    intervals['from'] = intervals['index']
-    intervals['to'] = intervals['index'].shift(-1)
-    # set last "to" to max value of index
-    intervals.iloc[-1, 3] = log['index'].max() + 1 # (to get an inclusive interval of max)
-    # print(intervals)
-    
-    # convert interval into lists with all relevant indexes
-    # (later, we can "explode" these into their own rows)
-
-    def gen_interval(row):
-        if row.iloc[0] == row.iloc[1]:
-            return [int(row.iloc[0])]
-        else:
-            return range(int(row.iloc[0]), int(row.iloc[1]))
-
-    intervals['list'] = intervals[['from', 'to']].apply(gen_interval, axis=1)
-    # use timestamp as index; we need them in the explode result
-    # (we know they're unique at this point)
-    intervals = intervals.set_index(intervals['time:timestamp'])
-    intervals = intervals[['list']]
-    # print(intervals)
-    
-    # explode the interval lists into separate rows
-
-    # add timestamp index as separate column (reset index)
-    intervals = intervals['list'].explode().reset_index()
-    intervals = intervals.rename({'time:timestamp': 'time:timestamp2', 'list': 'index'}, axis=1)
-    # print(intervals)
-    
-    # join log with intervals based on the index 
-    # for now, their new timestamp will be "time:timestamp2"
-    # (use left join; rows with time_diff2 > 0 will be N/A)
-    log2 = log.merge(intervals, left_on='index', right_on='index', how='left')
-    # for cases where time_diff2 > 0, simply copy the original timestamps
-    log2.loc[log2['time_diff2']>0, 'time:timestamp2'] = log2.loc[log2['time_diff2']>0, 'time:timestamp']
-    
-    # drop current timestamp & unused columns (but keep index)
-    log2 = log2.drop([ 'time_diff', 'time_diff2', 'time:timestamp' ], axis=1)
-    # this is our new timestamp
-    log2 = log2.rename({ 'time:timestamp2': 'time:timestamp' }, axis=1)
-    
-    log2 = log2.sort_values(by=['case:concept:name', 'time:timestamp', 'concept:name'])
-    return log2
-
-    # alternative loop-based solution
-    # # (takes 3-4 minutes vs. 2-4 seconds)
-
-    # log['time:timestamp2'] = log['time:timestamp']
-
-    # cur_ts = None
-    # for idx, row in log.iterrows():
-    #     if (idx % 1000 == 0):
-    #         print(idx, round((idx / log.shape[0]) * 100, 2), "%")
-        
-    #     if row['time_diff2'] > 0: # always the case for the first row
-    #          cur_ts = row['time:timestamp']
-        
-    #     else:
-    #         log.loc[idx, 'time:timestamp2'] = cur_ts
-
-
-def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
+    cases = column_codes(log['case:concept:name'])
+    ts = log['time:timestamp'].to_numpy()
+    pos = np.arange(len(log))
+    case_starts = np.r_[True, cases[1:] != cases[:-1]] if len(log) > 0 else np.zeros(0, dtype=bool)
+    
+    match measure:
+        case 'chained':
+            # new anchor wherever the time difference was _not_ less than interval
+            # (first events of cases have no time difference)
+            time_diff = log['time_diff'].to_numpy()
+            anchors = case_starts | np.isnan(time_diff) | ((time_diff >= interval) & (time_diff > 0))
+        case 'anchor':
+            anchors = anchor_chain(cases, ts, case_starts, interval)
+        case _:
+            raise ValueError(f"Unsupported measure: {measure}")
+    
+    # anchors' timestamps apply to all subsequent rows until the next anchor
+    # (forward-fill of anchor positions)
+    anchor_pos = np.maximum.accumulate(np.where(anchors, pos, 0))
+    log2 = log.drop('time_diff', axis=1).assign(**{ 'time:timestamp': ts[anchor_pos] })
+    
+    # (anchoring keeps the case & timestamp order; often, also that of the activities)
+    return sort_events(log2, ['case:concept:name', 'time:timestamp', 'concept:name'])
+
+
+# greedy anchors per case: first event at least <interval> seconds after the current anchor
+# (all cases at once; each iteration advances every case by one anchor)
+def anchor_chain(cases, ts, case_starts, interval):
+    ts_ns = ts.astype('datetime64[ns]').astype(np.int64)
+    # sorted key over (case, timestamp), to binary search the next anchor of all cases at once
+    case_codes = np.cumsum(case_starts) - 1
+    uniq_ts = np.unique(ts_ns)
+    key = case_codes * (len(uniq_ts) + 1) + np.searchsorted(uniq_ts, ts_ns)
+    case_ends = np.r_[np.flatnonzero(case_starts)[1:], len(ts)]
+    
+    anchors = case_starts.copy()
+    frontier = np.flatnonzero(case_starts)
+    ends = case_ends
+    while len(frontier) > 0:
+        target = case_codes[frontier] * (len(uniq_ts) + 1) + np.searchsorted(uniq_ts, ts_ns[frontier] + int(interval * 1e9))
+        nexts = np.searchsorted(key, target, side='left')
+        within = nexts < ends
+        frontier, ends = nexts[within], ends[within]
+        anchors[frontier] = True
+    
+    return anchors
+
+
+@instrument
+def aggregate_events(log, events, max_timedelta, repl=None, verbose=False, engine='numpy'):
+    match engine:
+        case 'numpy':
+            return aggregate_events_numpy(log, events, max_timedelta, repl, verbose)
+        case 'loop':
+            return aggregate_events_loop(log, events, max_timedelta, repl, verbose)
+        case _:
+            raise ValueError(f"Unsupported engine: {engine}")
+
+
+# (reference implementation; aggregate_events_numpy yields the same result)
+def aggregate_events_loop(log, events, max_timedelta, repl=None, verbose=False):
     # log = log.copy()
     
     # - uses loops but more robust
@@ -291,7 +522,7 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
         def __str__(self):
             return f"case {self.id}: " + "; ".join(map(lambda g: g.__str__(), self.groups))
     
-    to_drop = []
+    to_drop = []; to_repl = []
     cur_case = Case(verbose=verbose); cur_group = Group()
     
     def record_case(cur_case, cur_group):
@@ -299,18 +530,19 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
         cur_group = record_group(cur_case, cur_group) if cur_group.size() > 0 else Group()
         # (testing) print non-empty cases
         if verbose: # and cur_case.size() > 0:
-            print(cur_case)
+            report(str(cur_case))
         cur_case = Case(verbose=verbose)
         return cur_case, cur_group
             
     def record_group(cur_case, cur_group, init_evt=None):
         nonlocal total_groups, total_size, total_simult, total_diff #, activ_orders
         if verbose and cur_group.size() != len(events):
-            print(f"case {cur_case.id}: non-complete group {cur_group}")
+            report(f"case {cur_case.id}: non-complete group {cur_group}")
         
         # - replace last event in group with 'repl' event
-        # log.loc[cur_group.idxes[-1], 'concept:name'] = repl
-        # to_drop.extend(cur_group.idxes[:-1])
+        if repl is not None:
+            to_repl.append(cur_group.idxes[-1])
+            to_drop.extend(cur_group.idxes[:-1])
         
         # - get timestamp differences using diff()
         # (time differences can be cumulative this way)
@@ -329,7 +561,8 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
         # print(total_diff)
         if diff <= max_timedelta:
             total_simult += 1
-            to_drop.extend(cur_group.idxes)
+            if repl is None:
+                to_drop.extend(cur_group.idxes)
         else:
             total_diff += diff
             
@@ -358,7 +591,7 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
         nonlocal cnt, size, cur_perc
         perc = int(cnt / size * 100)
         if perc != cur_perc and perc % 5 == 0:
-            print(f"{perc}% done")
+            report(f"{perc}% done", cnt, size)
         cnt += 1
         cur_perc = perc
     
@@ -391,11 +624,12 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
     # record last case
     record_case(cur_case, cur_group)
     
-    print("# groups:", total_groups, "total size:", total_size, "avg size:", round(total_size/total_groups, 2))
-    print("# groups:", total_groups, "# simult:", total_simult, "avg:", round(total_simult/total_groups*100, 2), "%")
-    print("# groups:", total_groups, "avg_diff:", int(total_diff/total_groups), "s", "(", int(total_diff/total_groups/60), "m", ")")
+    report_groups(total_groups, total_size, total_simult, total_diff)
     # print(activ_orders)
     
+    if repl is not None:
+        log = log.copy()
+        log.loc[to_repl, 'concept:name'] = repl
     return log.drop(to_drop)
     
     # - uses dataframes but makes assumptions
@@ -415,49 +649,121 @@ def aggregate_events(log, events, max_timedelta, repl=None, verbose=False):
     # # drop other events not meeting those criteria (repl may also be in events)
     # # return log
     # return log.loc[(~ log['concept:name'].isin(events)) | (log['concept:name'] == repl), log.columns != 'evt_cnt']
+
+
+# - uses integer-coded activities & per-case offsets
+# (same groups, dropped rows & stats as aggregate_events_loop)
+def aggregate_events_numpy(log, events, max_timedelta, repl=None, verbose=False):
+    num_evts = len(events)
+    
+    # a new case starts whenever the case id changes (like the loop)
+    case_ids = column_codes(log['case:concept:name'])
+    case_start = np.ones(len(case_ids), dtype=bool)
+    case_start[1:] = case_ids[1:] != case_ids[:-1]
+    case_run = np.cumsum(case_start) - 1
+    
+    # only keep positions of (integer-coded) events to be aggregated
+    codes = lookup_codes(log['concept:name'], events)
+    pos = np.flatnonzero(codes >= 0)
+    codes = codes[pos]; runs = case_run[pos]
+    num = len(pos)
+    idx = np.arange(num)
+    
+    # per event, prior occurrence of the same event within the same case (or -1)
+    order = np.lexsort((idx, codes, runs))
+    prior = np.full(num, -1)
+    same = (runs[order[1:]] == runs[order[:-1]]) & (codes[order[1:]] == codes[order[:-1]])
+    prior[order[1:][same]] = order[:-1][same]
+    
+    # size of a group starting at each position:
+    # group ends at case end, at a repeated event, or when it is full
+    sizes = np.full(num, num_evts)
+    open_grp = np.ones(num, dtype=bool)
+    for d in range(1, num_evts):
+        nxt = np.minimum(idx + d, num - 1)
+        stop = open_grp & ((idx + d >= num) | (runs[nxt] != runs) | (prior[nxt] >= idx))
+        sizes[stop] = d
+        open_grp &= ~stop
+    
+    # follow groups from each case's first event
+    # (# iterations = max # groups per case)
+    is_start = np.zeros(num, dtype=bool)
+    cur = np.flatnonzero(np.r_[True, runs[1:] != runs[:-1]]) if num > 0 else idx
+    while len(cur) > 0:
+        is_start[cur] = True
+        nxt = cur + sizes[cur]
+        cur = nxt[(nxt < num) & (runs[np.minimum(nxt, num - 1)] == runs[cur])]
+    
+    starts = np.flatnonzero(is_start)
+    grp_sizes = np.diff(np.r_[starts, num])
+    firsts = pos[starts]; lasts = pos[starts + grp_sizes - 1]
+    
+    if verbose:
+        for first, size in zip(starts[grp_sizes != num_evts], grp_sizes[grp_sizes != num_evts]):
+            grp_idxes = log.index[pos[first:first + size]]
+            grp_evts = log['concept:name'].iloc[pos[first:first + size]]
+            grp_str = " (" + ", ".join([ f"'{evt}'@{i}" for evt, i in zip(grp_evts, grp_idxes) ]) + ") "
+            report(f"case {log['case:concept:name'].iloc[pos[first]]}: non-complete group {grp_str}")
+    
+    # - drop groups with "simultaneous" events (as per max_timedelta)
+    ts = log['time:timestamp'].to_numpy()
+    diffs = (ts[lasts] - ts[firsts]) / np.timedelta64(1, 's')
+    simult = diffs <= max_timedelta
+    
+    total_groups = len(starts); total_size = num
+    total_simult = int(simult.sum())
+    # (cumsum adds up sequentially, like the loop does)
+    total_diff = np.cumsum(diffs[~simult])[-1] if total_simult < total_groups else 0
+    
+    if total_groups > 0:
+        report_groups(total_groups, total_size, total_simult, total_diff)
+    
+    if repl is not None:
+        # - replace each group with a single 'repl' event (i.e., its last event)
+        drop_pos = pos[~np.isin(idx, starts + grp_sizes - 1)]
+        # (only copies the activity column)
+        log = log.assign(**{ 'concept:name': replace_at(log['concept:name'], lasts, repl) })
+    else:
+        drop_pos = pos[np.repeat(simult, grp_sizes)]
     
-    
+    return log.drop(log.index[drop_pos])
+
+
+def report_groups(total_groups, total_size, total_simult, total_diff):
+    report(f"# groups: {total_groups} total size: {total_size} avg size: {round(total_size/total_groups, 2)}")
+    report(f"# groups: {total_groups} # simult: {total_simult} avg: {round(total_simult/total_groups*100, 2)} %")
+    report(f"# groups: {total_groups} avg_diff: {int(total_diff/total_groups)} s ( {int(total_diff/total_groups/60)} m )")
+
+
 # stats for events
+# (same as in log_stats, with the log first; all via the log's profile)
 
 # count total number of occurrences of events (absolute & percentage)
+@instrument
 def count_events(log, evt_col='concept:name', case_col='case:concept:name', plot=True):
-    total_evts = len(log[evt_col])
-    evt_counts = log.groupby(evt_col)[case_col].count().rename('cnt').to_frame()
-    evt_counts['perc'] = 100 / total_evts * evt_counts['cnt']
-    evt_counts = evt_counts.sort_values(by='perc', ascending=False)
-    # for idx, row in evt_counts.items():
-    #     print(idx, row[0], row[1])
+    evt_counts = get_profile(log, evt_col, case_col).event_counts()
     if plot:
         ax = evt_counts[['perc']].plot.bar()
         # ax.xaxis.set_visible(False)
     return evt_counts
 
 # per event, count number of cases that it occurs in (absolute & percentage)
+@instrument
 def count_cases_per_event(log, evt_col='concept:name', case_col='case:concept:name', plot=True):
-    total_cases = len(log[case_col].unique())
-    evts_cases = log.groupby(evt_col)[case_col].unique().rename('cases').to_frame()
-    evts_cases['cases'] = evts_cases['cases'].apply(len)
-    evts_cases['perc'] = 100 / total_cases * evts_cases['cases']
-    evt_cases = evts_cases.sort_values(by='perc', ascending=False)
+    evt_cases = get_profile(log, evt_col, case_col).cases_per_event()
     if plot:
         ax = evt_cases[['perc']].plot.bar()
         # ax.xaxis.set_visible(False)
     return evt_cases
 
 # filter log
+@instrument
 def filter_events_on_counts(log, counts, leq_perc, evt_col='concept:name'):
-    keep_evts = counts[counts['perc']>leq_perc].index.array
-    return log[log[evt_col].isin(keep_evts)]
+    return log_stats.filter_events_on_counts(evt_col, leq_perc, counts, log)
 
 
 # stats for traces
 
+@instrument
 def get_trace_lengths(log, evt_col='concept:name', case_col='case:concept:name', plot=True):
-    trace_lens = log.groupby(case_col)[evt_col].count()
-    trace_lens = trace_lens.sort_values(ascending=False)
-    # for idx, cnt in trace_lens.items():
-    #     print(idx, cnt)
-    if plot:
-        ax = trace_lens.plot.bar()
-        ax.xaxis.set_visible(False)
-    return trace_lens
\ No newline at end of file
+    return log_stats.get_trace_lengths(evt_col, case_col, log, plot)
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+from trace_index import TraceIndex
+
+# reproducible case sampling, for fast previews of large logs
+# (samples whole cases; strata keep their share of the log)
+# - by='variant': per variant (also rare variants get their chance)
+# - by='length': per trace length bin (see num_bins)
+# - by='period': per period of the case's first event (see freq)
+# - by=None: simple random sample of cases
+
+def sample_cases(log, frac, by='variant', seed=0, index=None, num_bins=10, freq='M'):
+    index = TraceIndex.from_log(log) if index is None else index
+    index.check_log(log)
+
+    keep_cases = sample_strata(get_strata(log, index, by, num_bins, freq), frac, seed)
+
+    return log[index.case_to_rows(keep_cases)]
+
+
+# stratum code per case
+def get_strata(log, index, by, num_bins=10, freq='M'):
+    match by:
+        case 'variant':
+            return index.variant_ids
+        case 'length':
+            # (quantile bins; fewer bins if lengths are too uniform)
+            return pd.qcut(index.lengths, num_bins, labels=False, duplicates='drop')
+        case 'period':
+            first_ts = log['time:timestamp'].to_numpy()[index.rows[index.offsets[:-1]]]
+            return pd.factorize(pd.PeriodIndex(first_ts, freq=freq))[0]
+        case None:
+            return np.zeros(index.num_cases, dtype=np.int64)
+        case _:
+            raise ValueError(f"Unsupported stratification: {by}")
+
+
+# systematic sample over cases ordered by stratum (& randomly within strata)
+# (each stratum gets the floor or ceiling of its share; total is frac of all cases)
+def sample_strata(strata, frac, seed=0):
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(strata)), strata))
+    # select where the running count of frac * cases passes the next integer
+    steps = np.floor(np.arange(len(strata) + 1) * frac + rng.random())
+    keep = np.zeros(len(strata), dtype=bool)
+    keep[order] = np.diff(steps) > 0
+    return keep
+
+
+# how closely the sample matches the full log
+# - dfg_edges: share of the log's dfg edges found in the sample
+# - dfg_edge_weight: share of the log's directly-follows occurrences on those edges
+# - dfg_l1: L1 distance between the relative edge frequencies (0: same, 2: disjoint)
+# - variant_coverage: share of the log's cases whose variant is in the sample
+def sample_report(log, sample, index=None, sample_index=None):
+    index = TraceIndex.from_log(log) if index is None else index
+    sample_index = TraceIndex.from_log(sample) if sample_index is None else sample_index
+
+    dfg, sample_dfg = get_dfg_counts(index), get_dfg_counts(sample_index)
+    dfg, sample_dfg = dfg.align(sample_dfg, fill_value=0)
+    in_sample = sample_dfg > 0
+
+    sample_variants = set(sample_index.variant_sequences())
+    covered = np.array([ seq in sample_variants for seq in index.variant_sequences() ], dtype=bool)
+    counts = index.variant_counts()
+
+    return { 'cases': index.num_cases, 'sample_cases': sample_index.num_cases,
+             'variants': index.num_variants, 'sample_variants': sample_index.num_variants,
+             'dfg_edges': float(in_sample[dfg > 0].mean()) if (dfg > 0).any() else 1.0,
+             'dfg_edge_weight': float(dfg[in_sample].sum() / dfg.sum()) if dfg.sum() > 0 else 1.0,
+             'dfg_l1': float((dfg / max(dfg.sum(), 1) - sample_dfg / max(sample_dfg.sum(), 1)).abs().sum()),
+             'variant_coverage': float(counts[covered].sum() / counts.sum()) if counts.sum() > 0 else 1.0 }
+
+
+# directly-follows counts, indexed by (src, tgt) activity
+def get_dfg_counts(index):
+    events = index.events
+    inner = np.ones(len(events), dtype=bool)
+    inner[index.offsets[:-1][index.offsets[:-1] < len(events)]] = False
+    pos = np.flatnonzero(inner)
+    num_activs = len(index.activities)
+    edges = events[pos - 1].astype(np.int64) * num_activs + events[pos]
+    codes, counts = np.unique(edges, return_counts=True)
+    return pd.Series(counts, index=pd.MultiIndex.from_arrays([ index.activities[codes // num_activs], index.activities[codes % num_activs] ],
+                                                            names=[ 'src', 'tgt' ]))
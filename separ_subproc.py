@@ -1,18 +1,38 @@
 import pandas as pd
-import os, shutil
+import numpy as np
+import os, json, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from instrument import instrument, report
+from compact_log import add_suffix
 
-def separ_subproc(subproc_evts, non_subproc_evts, parent_col, subactiv_col, non_subactiv_col, dir_subproc, path_log):
-    # create groups based on parent column
-    # (we can just combine all cases here per activity)
-    labeled_logs = [ (g, df) for g, df in subproc_evts.groupby(parent_col) ]
+# fmt: 'csv' or 'parquet' (one file per label in <dir_subproc>/logs; i.e., a partitioned dataset)
+# (sublogs are sorted on case & timestamp; events without a label are left out, like with groupby)
+# workers: # threads for writing sublogs
+# (reruns only rewrite sublogs whose events changed; see partitions.json)
+@instrument
+def separ_subproc(subproc_evts, non_subproc_evts, parent_col, subactiv_col, non_subactiv_col, dir_subproc, path_log, fmt='csv', workers=None):
+    subproc_evts = subproc_evts[subproc_evts[parent_col].notna()]
+    # single sort; serves both the sublogs and the abstract log
+    sorted_evts = subproc_evts.sort_values(by=[parent_col, 'case:concept:name', 'time:timestamp'], kind='stable')
+    labels = sorted_evts[parent_col].to_numpy()
+    label_starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    label_ends = np.r_[label_starts[1:], len(labels)]
 
-    if os.path.exists(dir_subproc):
-        shutil.rmtree(dir_subproc)
-    os.makedirs(os.path.join(dir_subproc, "logs"))
+    dir_logs = os.path.join(dir_subproc, "logs")
+    os.makedirs(dir_logs, exist_ok=True)
+    path_parts = os.path.join(dir_subproc, "partitions.json")
+    prior_parts = {}
+    if os.path.exists(path_parts):
+        with open(path_parts) as f:
+            prior_parts = json.load(f)
+    parts = {}
 
-    # per activity,
-    for label, sublog in labeled_logs:        
-        print(f"{label} (# events: {sublog.shape[0]})")
+    # create groups based on parent column
+    # (we can just combine all cases here per activity)
+    to_write = []
+    for start, end in zip(label_starts, label_ends):
+        label = labels[start]
+        sublog = sorted_evts.iloc[start:end]
 
         # the subactivity column will be the activity name here
         if subactiv_col != 'concept:name':
@@ -20,21 +40,57 @@ def separ_subproc(subproc_evts, non_subproc_evts, parent_col, subactiv_col, non_
                 sublog = sublog.drop('concept:name', axis=1)
             sublog = sublog.rename({subactiv_col: 'concept:name'}, axis=1)
 
-        # not necessary if groupby retains sorting order
-        # sublog = sublog.sort_values(by=['case:concept:name', 'time:timestamp', 'concept:name'])
-        # store log
-        sublog.to_csv(os.path.join(dir_subproc, "logs", f"{label.replace('/', '_')}.csv"), index=False)
-        
+        file = f"{label.replace('/', '_')}.{fmt}"
+        parts[file] = hash_sublog(sublog)
+        unchanged = prior_parts.get(file) == parts[file] and os.path.exists(os.path.join(dir_logs, file))
+        report(f"{label} (# events: {sublog.shape[0]})" + (" (unchanged)" if unchanged else ""), len(parts), len(label_starts))
+        if not unchanged:
+            to_write.append((sublog, os.path.join(dir_logs, file)))
+
+    # store logs
+    if workers is None:
+        for sublog, path in to_write:
+            write_sublog(sublog, path, fmt)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda job: write_sublog(*job, fmt), to_write))
+
+    # drop sublogs of labels that no longer exist
+    for file in os.listdir(dir_logs):
+        if file not in parts and (file.endswith(".csv") or file.endswith(".parquet")):
+            os.remove(os.path.join(dir_logs, file))
+    with open(path_parts, "w") as f:
+        json.dump(parts, f)
+
     # per case, per subprocess, replace all sub-events by single start & end event
-    sorted_grouped = subproc_evts.sort_values(['case:concept:name', parent_col, 'time:timestamp']).groupby(['case:concept:name', parent_col])
-    start_evts = sorted_grouped.first().reset_index(); start_evts['concept:name'] = start_evts[parent_col] + ' [begin]'
-    end_evts = sorted_grouped.last().reset_index(); end_evts['concept:name'] = end_evts[parent_col] + ' [end]'
+    # (first & last non-null value per column of each (label, case) group; groups are already in order)
+    grouped = sorted_evts.groupby([parent_col, 'case:concept:name'], sort=False, observed=True)
+    start_evts = grouped.first().reset_index()[sorted_evts.columns]
+    start_evts = start_evts.assign(**{ 'concept:name': add_suffix(start_evts[parent_col], ' [begin]') })
+    end_evts = grouped.last().reset_index()[sorted_evts.columns]
+    end_evts = end_evts.assign(**{ 'concept:name': add_suffix(end_evts[parent_col], ' [end]') })
     abstract_log = pd.concat([start_evts, end_evts])
-    
+
     # re-add the non-subprocess activities
-    non_subproc_evts['concept:name'] = non_subproc_evts[non_subactiv_col]
+    # (without changing the caller's dataframe)
+    non_subproc_evts = non_subproc_evts.assign(**{ 'concept:name': non_subproc_evts[non_subactiv_col] })
     # important to sort on concept:name here as well; assures the same ordering for "almost-simultaneous" events
-    abstract_log = pd.concat([ abstract_log, non_subproc_evts ], ignore_index=True).sort_values(by=['case:concept:name','time:timestamp']) #, 'concept:name'])
+    abstract_log = pd.concat([ abstract_log, non_subproc_evts ], ignore_index=True).sort_values(by=['case:concept:name','time:timestamp'], kind='stable') #, 'concept:name'])
     abstract_log.to_csv(path_log, index=False)
-    
-    return abstract_log
\ No newline at end of file
+
+    return abstract_log
+
+
+@instrument
+def write_sublog(sublog, path, fmt):
+    if fmt == 'parquet':
+        sublog.to_parquet(path, index=False)
+    else:
+        sublog.to_csv(path, index=False)
+
+
+def hash_sublog(sublog):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(list(sublog.columns)).encode())
+    h.update(pd.util.hash_pandas_object(sublog, index=False).to_numpy().tobytes())
+    return h.hexdigest()
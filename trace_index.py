@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import os, pickle
+
+# integer-encoded traces of a log (CSR layout):
+# - activities: activity vocabulary (code -> name)
+# - case_ids: case id per case
+# - events: int32 activity codes of all events, in case/timestamp order
+#   (ties in activity order, not in log row order; so, traces & variants don't depend on how the log is sorted)
+# - offsets: start of each case in events (+ total # events at the end)
+# - variant_ids: variant per case (ids in order of first occurrence)
+# - rows: position of each event in the original log
+# (build once per log, then pass to the per-case utilities)
+
+class TraceIndex:
+
+    arrays = [ 'events', 'offsets', 'variant_ids', 'rows' ]
+
+    def __init__(self, activities, case_ids, events, offsets, variant_ids, rows):
+        self.activities = activities
+        self.case_ids = case_ids
+        self.events = events
+        self.offsets = offsets
+        self.variant_ids = variant_ids
+        self.rows = rows
+
+    @classmethod
+    def from_log(cls, log):
+        case_codes, case_ids = pd.factorize(log['case:concept:name'], sort=True)
+        activ_codes, activities = pd.factorize(log['concept:name'], sort=True)
+
+        # sort on case, timestamp, activity (like log_per_case)
+        keys = [ activ_codes, case_codes ]
+        if 'time:timestamp' in log.columns:
+            keys.insert(1, pd.factorize(log['time:timestamp'], sort=True)[0])
+        rows = np.lexsort(keys)
+
+        events = activ_codes[rows].astype(np.int32)
+        lengths = np.bincount(case_codes, minlength=len(case_ids))
+        offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+
+        return cls(np.asarray(activities, dtype=object), np.asarray(case_ids, dtype=object),
+                   events, offsets, get_variant_ids(events, offsets), rows.astype(np.int64))
+
+    @property
+    def num_cases(self):
+        return len(self.case_ids)
+
+    @property
+    def num_rows(self):
+        return len(self.rows)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def num_variants(self):
+        return int(self.variant_ids.max()) + 1 if len(self.variant_ids) > 0 else 0
+
+    def case_events(self, case):
+        return self.events[self.offsets[case]:self.offsets[case + 1]]
+
+    def case_sequence(self, case):
+        return list(self.activities[self.case_events(case)])
+
+    # number of cases per variant
+    def variant_counts(self):
+        return np.bincount(self.variant_ids, minlength=self.num_variants)
+
+    # first case of each variant
+    def variant_cases(self):
+        cases = np.full(self.num_variants, -1, dtype=np.int64)
+        # (reversed, so first case is written last)
+        rev = np.arange(self.num_cases)[::-1]
+        cases[self.variant_ids[rev]] = rev
+        return cases
+
+    def variant_sequences(self):
+        return [ tuple(self.case_sequence(case)) for case in self.variant_cases() ]
+
+    # events of one case per variant (in variant id order), in the same CSR layout
+    # returns events, offsets
+    def variant_events(self):
+        cases = self.variant_cases()
+        starts, ends = self.offsets[cases], self.offsets[cases + 1]
+        offsets = np.r_[0, np.cumsum(ends - starts)].astype(np.int64)
+        events = self.events[np.arange(offsets[-1]) + np.repeat(starts - offsets[:-1], ends - starts)]
+        return events, offsets
+
+    # position of each event within its case
+    def positions(self):
+        return np.arange(len(self.events)) - np.repeat(self.offsets[:-1], self.lengths)
+
+    # per row of the log, the value of its case (e.g., a row mask from a case mask)
+    def case_to_rows(self, case_values):
+        case_values = np.asarray(case_values)
+        row_values = np.empty(self.num_rows, dtype=case_values.dtype)
+        row_values[self.rows] = np.repeat(case_values, self.lengths)
+        return row_values
+
+    def check_log(self, log):
+        if len(log) != self.num_rows:
+            raise ValueError(f"trace index was built for {self.num_rows} events, log has {len(log)}")
+
+    # - storing & loading
+    # (arrays as separate .npy files, so they can be memory-mapped)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name in TraceIndex.arrays:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(path, "vocab.pkl"), "wb") as f:
+            pickle.dump({ 'activities': self.activities, 'case_ids': self.case_ids }, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        arrays = { name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in TraceIndex.arrays }
+        with open(os.path.join(path, "vocab.pkl"), "rb") as f:
+            vocab = pickle.load(f)
+        return cls(vocab['activities'], vocab['case_ids'], **arrays)
+
+
+# identical code sequences are the same variant
+# (ids in order of first occurrence)
+def get_variant_ids(events, offsets):
+    traces = [ events[start:end].tobytes() for start, end in zip(offsets[:-1], offsets[1:]) ]
+    variant_ids, _ = pd.factorize(pd.Series(traces, dtype=object))
+    return variant_ids.astype(np.int32)
+
+
+def get_trace_index(log):
+    return log if isinstance(log, TraceIndex) else TraceIndex.from_log(log)
@@ -1,72 +1,86 @@
 import pandas as pd
+import numpy as np
 import pm4py
 from collections import Counter
 from collections_extended import frozenbag
-import itertools
 from pm4py.objects.conversion.log import converter as log_converter
 from pm4py.objects.log.obj import EventLog
+from trace_index import TraceIndex, get_trace_index, get_variant_ids
+from instrument import instrument, report
 
 # from pm4py.algo.filtering.log.variants.variants_filter import filter_log_variants_percentage
 # from pm4py.objects.conversion.log.variants import to_data_frame
 
+# (log can also be a TraceIndex)
+# (events in case, timestamp & activity order, like all variant utilities; see TraceIndex)
+@instrument
 def get_variants(log, unordered=False, verbose=False):
+    index = get_trace_index(log)
     if verbose:
-        print("# total:", len(log['case:concept:name'].unique()))
-    
-    variants = log.groupby('case:concept:name')['concept:name'].agg(tuple).to_dict()
-    variants = Counter(variants.values())
+        report(f"# total: {index.num_cases}")
+    variants = Counter(dict(zip(index.variant_sequences(), index.variant_counts().tolist())))
     
     if verbose:
-        print("# unique variants:", len(list(variants.keys())))
+        report(f"# unique variants: {len(variants)}")
     if unordered:
         unvariants = { frozenbag(variant): 0 for variant in variants.keys() }
         for variant_series, cov_amt in variants.items():
             unvariants[frozenbag(variant_series)] += cov_amt
         if verbose:
-            print("# unique unordered variants:", len(unvariants))
+            report(f"# unique unordered variants: {len(unvariants)}")
         return unvariants
     else:
         return variants
 
+@instrument
 def get_variant_ratio(log, vars_stats):
     num_traces = len(log['case:concept:name'].unique())
     num_vars = vars_stats.shape[0]
     var_ratio = round((num_vars / num_traces) * 100, 2)
     return f"# traces = {num_traces}, # vars = {num_vars}, ratio = {var_ratio}"
 
+# (log can also be a TraceIndex)
+@instrument
 def get_variants_stats(log, plot=True, collapse_activseq=None):
-    variants = get_variants(log, unordered=False)
-    variants = pd.DataFrame(variants.items())
-    num_seq = len(log['case:concept:name'].unique())
-    num_var = variants.shape[0]
-    
-    variants.columns = ['sequence', 'cov_amt']
-    
+    index = get_trace_index(log)
+    events, offsets = index.variant_events()
+    return codes_to_stats(index.activities, events, offsets, index.variant_counts(), index.num_cases, plot, collapse_activseq)
+
+# (variants: as returned by get_variants; num_seq: total # cases)
+@instrument
+def variants_to_stats(variants, num_seq, plot=True, collapse_activseq=None):
+    sequences = list(variants.keys())
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    events, activities = pd.factorize(pd.Series([ a for seq in sequences for a in seq ], dtype=object))
+    offsets = np.r_[0, np.cumsum(lengths)]
+    counts = np.fromiter(variants.values(), dtype=np.int64, count=len(sequences))
+    return codes_to_stats(np.asarray(activities, dtype=object), events.astype(np.int32), offsets, counts, num_seq, plot, collapse_activseq)
+
+# (activities, events, offsets: one integer-encoded sequence per variant (see TraceIndex); counts: # cases per variant)
+@instrument
+def codes_to_stats(activities, events, offsets, counts, num_seq, plot=True, collapse_activseq=None):
     # to reduce variability, merge sequences of identical activities within variants
     # e.g., a - b - b - b - c => a -b - c ; a - b - c => a -b - c
     if collapse_activseq is not None:
-        # group repeating sequences (also len 1) of activities into lists
-        collapsed = [[ list(group) for key, group in itertools.groupby(variant) ] for variant in variants['sequence'] ]
-        # "collapse" lists for activities mentioned in activs
-        collapsed = [[ [ f"{group[0]}+" ] if group[0] in collapse_activseq else group for group in variant ] for variant in collapsed ]
-        # flatten all of the lists
-        collapsed = [ tuple(a for group in variant for a in group) for variant in collapsed ]        
-        variants['sequence'] = pd.Series(collapsed)
-        variants = variants.groupby('sequence')['cov_amt'].sum().reset_index().sort_values(by='cov_amt', ascending=False)
-
-    variants_sorted = variants.sort_values(by = 'cov_amt', ascending=False)
-    variants_sorted = variants_sorted.reset_index(drop=True)
-    variants_sorted['cov_perc'] = variants_sorted.apply(lambda row: 100 / num_seq * row['cov_amt'], axis=1)
-
-    cumul_cov_perc = []
-    cur_cov_perc = 0
-    for _, row in variants_sorted.iterrows(): # yeah, yeah ...
-        cur_cov_perc += row['cov_perc']
-        cumul_cov_perc.append(cur_cov_perc)
-    variants_sorted['cov_perc_cumul'] = cumul_cov_perc
-
-    var_perc = 100 / num_var
-    variants_sorted['var_perc_cumul'] = variants_sorted.apply(lambda row: (row.name + 1) * var_perc, axis=1)
+        activities, events, offsets = collapse_runs(activities, events, offsets, collapse_activseq)
+        # collapsed sequences may now coincide
+        variant_ids = get_variant_ids(events, offsets)
+        counts = np.bincount(variant_ids, weights=counts).astype(np.int64)
+        firsts = np.full(len(counts), -1, dtype=np.int64)
+        rev = np.arange(len(variant_ids))[::-1]
+        firsts[variant_ids[rev]] = rev
+        sequences = split_sequences(activities, events, offsets)
+        sequences = [ sequences[first] for first in firsts ]
+    else:
+        sequences = split_sequences(activities, events, offsets)
+    num_var = len(counts)
+
+    order = np.argsort(-counts, kind='stable')
+    variants_sorted = pd.DataFrame({ 'sequence': pd.Series([ sequences[i] for i in order ], dtype=object),
+                                     'cov_amt': counts[order] })
+    variants_sorted['cov_perc'] = 100 / num_seq * variants_sorted['cov_amt']
+    variants_sorted['cov_perc_cumul'] = variants_sorted['cov_perc'].cumsum()
+    variants_sorted['var_perc_cumul'] = (np.arange(num_var) + 1) * (100 / num_var)
 
     if plot:
         ax = variants_sorted[['cov_perc']].plot.bar()
@@ -74,6 +88,26 @@ def get_variants_stats(log, plot=True, collapse_activseq=None):
 
     return variants_sorted
 
+# replace each run of a collapsed activity (also len 1) by a single "<activity>+"
+def collapse_runs(activities, events, offsets, collapse_activseq):
+    is_collapsed = np.isin(activities, list(collapse_activseq))
+    case_start = np.zeros(len(events), dtype=bool)
+    case_start[offsets[:-1][offsets[:-1] < len(events)]] = True
+    repeat = np.r_[False, events[1:] == events[:-1]] & ~case_start
+    keep = ~(repeat & is_collapsed[events])
+
+    # collapsed activities get new codes, after the existing ones
+    new_codes = np.arange(len(activities))
+    new_codes[is_collapsed] = len(activities) + np.arange(is_collapsed.sum())
+    activities = np.r_[activities, np.array([ f"{a}+" for a in activities[is_collapsed] ], dtype=object)]
+
+    kept_before = np.r_[0, np.cumsum(keep)]
+    return activities, new_codes[events[keep]].astype(np.int32), kept_before[offsets]
+
+def split_sequences(activities, events, offsets):
+    flat = activities[events].tolist()
+    return [ tuple(flat[start:end]) for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()) ]
+
 def print_variants_stats(vars_stats):
     for idx, row in vars_stats.iterrows():
         print(f"coverage: amt = {row['cov_amt']}, perc = {row['cov_perc']}, cumul = {row['cov_perc_cumul']}")
@@ -82,33 +116,52 @@ def print_variants_stats(vars_stats):
 
 
 # how many cases (percentage) do var_perc of variants (sorted desc by coverage) cover?
+@instrument
 def get_case_coverage(var_perc, vars_stats):
     return get_x_coverage(var_perc, 'var_perc_cumul', 'cov_perc_cumul', vars_stats)
 
 
 # how many variants (percentage) are needed (sorted desc by coverage) to cover case_perc of cases?
+@instrument
 def get_variant_coverage(case_perc, vars_stats):
     return get_x_coverage(case_perc, 'cov_perc_cumul', 'var_perc_cumul', vars_stats)
 
 
 # get all variants that are needed (sorted desc by coverage) to cover case_perc of cases
+@instrument
 def get_covering_variants(case_perc, vars_stats):
-    first_k = vars_stats.loc[vars_stats['cov_perc_cumul'] <= case_perc]
-    return first_k
+    return vars_stats.iloc[:num_within(case_perc, vars_stats['cov_perc_cumul'])]
 
 
+# (raises IndexError if not even the first variant is within perc)
 def get_x_coverage(perc, cmp_col, ret_col, vars_stats):
-    first_k = vars_stats.loc[vars_stats[cmp_col] <= perc]
-    return first_k.iloc[-1][ret_col]
-    
-    
-def filter_traces_on_variants(log, variants):
-    traces = log.groupby('case:concept:name')['concept:name'].apply(tuple).rename('sequence').reset_index()
-    # add case's sequence to all events of that case
-    merged_log = log.merge(traces) # will merge on case:concept:name
+    num = num_within(perc, vars_stats[cmp_col])
+    if num == 0:
+        raise IndexError(f"no variants with {cmp_col} <= {perc}")
+    return vars_stats[ret_col].iloc[num - 1]
+
+
+# cumulative columns are sorted; binary search for the # rows with values <= perc
+def num_within(perc, cumul):
+    return int(np.searchsorted(cumul.to_numpy(), perc, side='right'))
     
-    # filter all events with a sequence found in variants
-    filtered_log = merged_log[merged_log['sequence'].isin(variants['sequence'])]
-    filtered_log = filtered_log[['case:concept:name', 'concept:name', 'time:timestamp']]
     
-    return filtered_log
\ No newline at end of file
+# keeps all events (and columns) of cases whose sequence is one of variants['sequence']
+# (index: TraceIndex of log, if already built)
+@instrument
+def filter_traces_on_variants(log, variants, index=None):
+    index = TraceIndex.from_log(log) if index is None else index
+    index.check_log(log)
+
+    # compare encoded sequences per variant, instead of per-case tuples
+    # (sequences with unknown activities can't match)
+    codes = { activ: code for code, activ in enumerate(index.activities) }
+    wanted = set()
+    for seq in variants['sequence']:
+        if all(activ in codes for activ in seq):
+            wanted.add(np.array([ codes[activ] for activ in seq ], dtype=index.events.dtype).tobytes())
+    cases = index.variant_cases()
+    keep_vars = np.array([ index.case_events(case).tobytes() in wanted for case in cases ], dtype=bool)
+
+    # select on a per-row mask
+    return log[index.case_to_rows(keep_vars[index.variant_ids])]
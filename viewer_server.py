@@ -0,0 +1,253 @@
+import os, re, sys, json, asyncio, argparse, mimetypes
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, unquote
+import mine_utils
+from mine_utils import ProcAnn, get_log, get_source_key, count_events, filter_events_on_counts
+from variant_stats import get_variants_stats, get_covering_variants, filter_traces_on_variants
+from batch_render import get_manifest
+from instrument import progress_to
+
+# local backend for viewer/index.html: same graphs.json & .gv endpoints, but graphs are mined on demand
+# (instead of pre-rendering all of them with batch_render)
+# - <root>/level<lvl>/graphs.json: sublogs in <root>/level<lvl>/logs/*.csv (or the graphs.json on disk, if any)
+# - <root>/level<lvl>/<format>[/<ann>]/<name>.gv: mined from <root>/level<lvl>/logs/<name>.csv
+#   - format: see mine_graph; others (e.g., dcr) are served from disk
+#   - thresholds (query; applied before mining, see apply_thresholds):
+#     coverage=<perc>: keep the most frequent variants covering perc % of cases
+#     evt_perc=<perc>: drop events with perc % or less of all events
+# - _stats: result cache stats
+# - anything else: viewer files, then files under data_dir
+# (results are kept in a bounded LRU cache, keyed on the log file's size & mtime;
+#  concurrent requests for the same graph share one mining job)
+#
+# python viewer_server.py <data_dir> --port 8000 --workers 4
+# (data_dir holds the viewer's root, e.g., lifecycles/all-17_10_25/level0/logs/main.csv)
+
+viewer_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "viewer")
+
+thresholds = [ 'coverage', 'evt_perc' ]
+
+graph_path = re.compile(r"/(?P<root>.+?)/level(?P<lvl>\d+)/(?P<format>[^/]+)(?:/(?P<ann>[^/]+))?/(?P<name>[^/]+)\.gv")
+manifest_path = re.compile(r"/(?P<root>.+?)/level(?P<lvl>\d+)/graphs\.json")
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# least recently used results (as futures, so that pending jobs are shared too)
+class ResultCache:
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_start(self, key, start_fn):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        self.misses += 1
+        future = start_fn()
+        self.entries[key] = future
+        # (failed jobs are not kept; next request retries)
+        future.add_done_callback(lambda f: self.discard(key, f))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return future
+
+    def discard(self, key, future):
+        if not future.cancelled() and future.exception() is None:
+            return
+        if self.entries.get(key) is future:
+            del self.entries[key]
+
+    def stats(self):
+        return { 'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'max_entries': self.max_entries }
+
+
+class ViewerServer:
+
+    def __init__(self, data_dir, viewer_dir=viewer_dir, cache_size=128, workers=None,
+                 default_format="bpmn", default_ann=ProcAnn.FREQ):
+        self.data_dir = Path(data_dir).resolve()
+        self.viewer_dir = Path(viewer_dir).resolve()
+        self.cache = ResultCache(cache_size)
+        self.default_format = default_format
+        self.default_ann = default_ann
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def serve_forever(self, host="127.0.0.1", port=8000):
+        try:
+            asyncio.run(self.serve(host, port))
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"serving {self.data_dir} on http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+    # one request per connection
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request_line = (await reader.readline()).decode('latin-1')
+                method, target, _ = request_line.split(" ", 2)
+                # (headers are not needed)
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                if method != 'GET':
+                    raise HttpError(405, f"Unsupported method: {method}")
+                status, content_type, body = 200, *(await self.route(target))
+            except HttpError as e:
+                status, content_type, body = e.status, "text/plain", e.message.encode()
+            except ValueError as e:
+                status, content_type, body = 400, "text/plain", str(e).encode()
+            except Exception as e:
+                status, content_type, body = 500, "text/plain", repr(e).encode()
+
+            writer.write(f"HTTP/1.1 {status} {status_text(status)}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    # returns (content type, body)
+    async def route(self, target):
+        url = urlsplit(target)
+        path = unquote(url.path)
+        query = dict(parse_qsl(url.query))
+
+        if path == "/_stats":
+            return "application/json", json.dumps(self.cache.stats()).encode()
+        if (match := graph_path.fullmatch(path)) and match['format'] in miners:
+            return "text/plain", await self.get_graph(**match.groupdict(), query=query)
+        if match := manifest_path.fullmatch(path):
+            return "application/json", await self.get_manifest(match['root'], match['lvl'])
+
+        if path in ("", "/"):
+            path = "/index.html"
+        for base in [ self.viewer_dir, self.data_dir ]:
+            file = safe_path(base, path)
+            if file is not None and file.is_file():
+                return mimetypes.guess_type(file.name)[0] or "application/octet-stream", await asyncio.to_thread(file.read_bytes)
+        raise HttpError(404, f"Not found: {path}")
+
+    async def get_graph(self, root, lvl, format, ann, name, query):
+        log_path = safe_path(self.data_dir, f"{root}/level{lvl}/logs/{name}.csv")
+        if log_path is None or not log_path.is_file():
+            raise HttpError(404, f"No log for: {root}/level{lvl}/{name}")
+        ann = ProcAnn(ann) if ann is not None else None
+        params = get_thresholds(query)
+
+        source = get_source_key(str(log_path))
+        key = (str(log_path), source['size'], source['mtime_ns'], format, ann, tuple(sorted(params.items())))
+        loop = asyncio.get_running_loop()
+        future = self.cache.get_or_start(key, lambda: loop.run_in_executor(self.executor, render_source, str(log_path), format, ann, params))
+        # (shield: a dropped connection shouldn't cancel the shared job)
+        return (await asyncio.shield(future)).encode()
+
+    async def get_manifest(self, root, lvl):
+        level_dir = safe_path(self.data_dir, f"{root}/level{lvl}")
+        if level_dir is None or not level_dir.is_dir():
+            raise HttpError(404, f"No level: {root}/level{lvl}")
+        # (manifest on disk has the intended default views)
+        if (level_dir / "graphs.json").is_file():
+            return await asyncio.to_thread((level_dir / "graphs.json").read_bytes)
+        names = sorted(path.stem for path in (level_dir / "logs").glob("*.csv"))
+        return json.dumps(get_manifest(names, self.default_format, self.default_ann)).encode()
+
+
+# - mining
+# (runs in the worker processes)
+
+miners = [ 'dfg', 'heur', 'alpha', 'ilp', 'induct', 'bpmn', 'petri_net' ]
+
+def render_source(log_path, format, ann, params):
+    with progress_to(None):
+        log = get_log(log_path, columns=[ 'case:concept:name', 'concept:name', 'time:timestamp' ])
+        log = apply_thresholds(log, **params)
+        if len(log) == 0:
+            raise ValueError(f"No events left with {params}")
+        return mine_graph(log, format, ann).source
+
+
+# (gviz of the mined model; like render_job)
+def mine_graph(log, format, ann=None):
+    match format:
+        case 'dfg':
+            return mine_utils.mine_dfg(log, ann or ProcAnn.FREQ, view=False)
+        case 'heur':
+            return mine_utils.mine_heur(log, ann or ProcAnn.FREQ, view=False)
+        case 'alpha':
+            return mine_utils.mine_alpha(log, view=False)
+        case 'ilp':
+            return mine_utils.mine_ilp(log, view=False)
+        case 'induct':
+            return mine_utils.mine_induct(log, view=False)
+        case 'bpmn' | 'petri_net':
+            return mine_utils.mine_induct(log, convert_to=format, ann=ann, view=False)
+        case _:
+            raise ValueError(f"Unsupported miner: {format}")
+
+
+def apply_thresholds(log, coverage=None, evt_perc=None):
+    if evt_perc is not None:
+        log = filter_events_on_counts(log, count_events(log, plot=False), evt_perc)
+    if coverage is not None:
+        log = filter_traces_on_variants(log, get_covering_variants(coverage, get_variants_stats(log, plot=False)))
+    return log
+
+
+def get_thresholds(query):
+    unknown = set(query) - set(thresholds)
+    if len(unknown) > 0:
+        raise ValueError(f"Unsupported parameters: {', '.join(sorted(unknown))}")
+    return { name: float(value) for name, value in query.items() }
+
+
+# path under base (or None, if it would escape base)
+def safe_path(base, path):
+    file = (base / path.lstrip("/")).resolve()
+    return file if file.is_relative_to(base) else None
+
+
+def status_text(status):
+    return { 200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error" }[status]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="serves the viewer, mining its graphs on demand")
+    parser.add_argument('data_dir', help="directory holding the viewer's root (<root>/level<lvl>/logs/*.csv)")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, help="mining processes (default: # cpus)")
+    parser.add_argument('--cache-size', type=int, default=128, help="# mined graphs kept in memory")
+    parser.add_argument('--default-format', default="bpmn", help="default view for sublogs without a graphs.json")
+    parser.add_argument('--default-ann', default=ProcAnn.FREQ.value, choices=[ ann.value for ann in ProcAnn ])
+    args = parser.parse_args(argv)
+
+    server = ViewerServer(args.data_dir, cache_size=args.cache_size, workers=args.workers,
+                          default_format=args.default_format, default_ann=ProcAnn(args.default_ann))
+    try:
+        server.serve_forever(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())